@@ -1,21 +1,74 @@
+import math
+import random
 import tempfile
 import time
 from pathlib import Path
-from typing import Union, Tuple, Type, Optional
+from typing import Union, Tuple, Type, Optional, Iterable, List, Iterator
+from urllib.parse import urlparse
 
-import cv2
 import humanize
 import numpy as np
 import rasterio as rio
+import rasterio.crs
 import rasterio.mask
+import rasterio.transform
+import rasterio.windows
 import rasterio.warp
-import requests
 from darkgeotile import BaseTile
 from pyproj import transform, Proj
 from shapely.geometry import Polygon
 
 import maps
-from utils import ImageFormat, get_expected_path, TileDownloadingProgressbar
+from metrics import Metrics
+from pixels import PixelLayout, get_tile_header, read_tile, get_pixel_layout, to_pixel_layout, get_gtiff_options, \
+    get_layout_of_gtiff, write_colormap
+from transport import Transport
+from utils import ImageFormat, get_expected_path, TileDownloadingProgressbar, DownloadEstimate, \
+    load_tiles_stats, update_tiles_stats, TileOrder, get_existent_tiles_tms
+
+
+def fetch_tiles(
+        map_: Type[maps.Map],
+        tiles: Iterable[BaseTile],
+        transport: Transport,
+        metrics: Optional[Metrics] = None
+) -> Iterator[Tuple[BaseTile, Optional[bytes]]]:
+    # language=rst
+    """
+    Request every tile from `map_` mirrors one by one until the first successful response.
+    :param map_: maps.Map subclass, which tiles will be downloaded
+    :param tiles: tiles for downloading
+    :param transport: transport for HTTP requests
+    :param metrics: optional collector of downloading counters and timings
+    :return: generator of tiles with their images as `bytes`, or with `None` if every mirror failed.
+    Tiles could be yielded not in `tiles` order
+    """
+    metrics = Metrics() if metrics is None else metrics
+
+    urls_gens = ((tile, map_.get_urls_gen(tile)) for tile in tiles)
+    for tile, attempts in transport.fetch(urls_gens, map_.get_timeout()):
+        for i, response in enumerate(attempts):
+            mirror = urlparse(response.url).netloc
+
+            metrics.inc('requests_total', mirror=mirror)
+            metrics.observe('request_ms', response.seconds * 1000, mirror=mirror)
+            if response.error is None:
+                metrics.inc('responses_total', mirror=mirror, status=response.status_code)
+                metrics.observe('ttfb_ms', response.headers_seconds * 1000, mirror=mirror)
+                metrics.observe('transfer_ms', (response.seconds - response.headers_seconds) * 1000, mirror=mirror)
+            else:
+                metrics.inc('network_errors_total', mirror=mirror)
+
+            if response.ok:
+                metrics.inc('bytes_total', len(response.content), mirror=mirror)
+                if not map_.is_ok(response.content):
+                    metrics.inc('blank_tiles_total', mirror=mirror)
+            else:
+                metrics.inc('failed_requests_total', mirror=mirror)
+                if i + 1 < len(attempts):
+                    metrics.inc('retries_total', mirror=mirror)
+
+        yield tile, attempts[-1].content if attempts and attempts[-1].ok else None
 
 
 def download_tiles(
@@ -24,69 +77,224 @@ def download_tiles(
         zoom: int,
         tiles_dir: Path,
         img_format: ImageFormat,
-        session: requests.Session,
+        transport: Transport,
         *,
+        order: TileOrder = TileOrder.HILBERT,
         overwriting=False,
-        printing=False
+        printing=False,
+        metrics: Optional[Metrics] = None
 ) -> None:
     # language=rst
     """
     Download tiles from `bbox` with `zoom` zoom-level to `tiles_dir` from `map_`.
+    Sizes and durations of downloaded tiles are added to `tiles_dir` stats for planning of next jobs.
     :param map_: maps.Map subclass, which tiles will be downloaded
     :param bbox: bbox of area coordinates in `map_.projection` reference system in from
     `(min_x, min_y, max_x, max_y)`
     :param zoom: zoom-level for tiles
     :param tiles_dir: path to directory for downloading
     :param img_format: tiles images format
-    :param session: object providing requests session
+    :param transport: transport for HTTP requests
+    :param order: order of tiles downloading
     :param overwriting: if `True`, will overwrite files with expected tiles names.
     if `False`, will skip existent files with expected tiles names.
     :param printing: if `True`, will print info about downloading. Default -- `False`
+    :param metrics: optional collector of downloading counters and timings
     :return:
     """
-    tile_generator = map_.get_tile_gen(bbox, zoom)
+    metrics = Metrics() if metrics is None else metrics
+    progressbar = None
 
     if printing:
-        tms_x_s, tms_y_s = zip(*[tile.tms for tile in map_.get_corner_tiles(bbox, zoom)])
-        tiles_num = (max(tms_x_s) - min(tms_x_s) + 1) * (max(tms_y_s) - min(tms_y_s) + 1)
+        tiles_num = map_.get_tiles_num(bbox, zoom)
 
         print(f'Downloading {tiles_num} tiles of {map_.__name__}...')
-        tile_generator = progressbar = TileDownloadingProgressbar(tile_generator, total=tiles_num)
+        progressbar = TileDownloadingProgressbar(total=tiles_num)
 
-    for tile in tile_generator:
-        path = get_expected_path(tile, tiles_dir, img_format)
-        path.parent.mkdir(parents=True, exist_ok=True)
+    def get_missing_tiles_gen():
+        for tile in map_.get_tile_gen(bbox, zoom, order):
+            path = get_expected_path(tile, tiles_dir, img_format)
+            path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not overwriting and path.exists():
-            continue
+            if not overwriting and path.exists():
+                metrics.inc('skipped_tiles_total')
+                if progressbar is not None:
+                    progressbar.update()
+                continue
 
-        for url in map_.get_urls_gen(tile):
-            response = session.get(url)
-            if response.ok:
-                if map_.is_ok(response.content):
-                    with path.open('wb') as file:
-                        file.write(response.content)
+            yield tile
+
+    downloaded_tiles_num, downloaded_bytes = 0, 0
+    start = time.perf_counter()
+    for tile, content in fetch_tiles(map_, get_missing_tiles_gen(), transport, metrics):
+        if content is not None:
+            if map_.is_ok(content):
+                with metrics.timer('write'), get_expected_path(tile, tiles_dir, img_format).open('wb') as file:
+                    file.write(content)
 
-                if printing:
-                    progressbar.update_avg_bytes_in_img(len(response.content))
+            downloaded_tiles_num += 1
+            downloaded_bytes += len(content)
 
-                time.sleep(map_.get_timeout())
-                break
-    session.close()
+            if progressbar is not None:
+                progressbar.update_avg_bytes_in_img(len(content))
+
+        if progressbar is not None:
+            progressbar.update()
+
+    if downloaded_tiles_num:
+        update_tiles_stats(
+            tiles_dir, map_, zoom, downloaded_tiles_num, downloaded_bytes, time.perf_counter() - start
+        )
 
     if printing:
+        progressbar.close()
+
         files_paths = (get_expected_path(t, tiles_dir, img_format) for t in map_.get_tile_gen(bbox, zoom))
         bytes_in_files = sum(fp.stat().st_size for fp in files_paths if fp.exists())
         print('done.')
         print(f'Existent tiles from given bbox has total size {humanize.naturalsize(bytes_in_files)}.')
 
 
+def estimate_download(
+        map_: Type[maps.Map],
+        bbox: Tuple[float, float, float, float],
+        zooms: Iterable[int],
+        tiles_dir: Optional[Path],
+        img_format: ImageFormat,
+        transport: Transport,
+        *,
+        sample_size: int = 5,
+        metrics: Optional[Metrics] = None
+) -> List[DownloadEstimate]:
+    # language=rst
+    """
+    Estimate size and duration of downloading `bbox` area from `map_` for every zoom-level from `zooms`.
+    Estimates are based on `sample_size` random missing tiles fetched from the area, and on stats and existent tiles
+    of `tiles_dir`. Sampled tiles are saved in `tiles_dir` and added to its stats,
+    so they wouldn't be downloaded and measured again.
+    :param map_: maps.Map subclass, which tiles will be downloaded
+    :param bbox: bbox of area coordinates in `map_.projection` reference system in from
+    `(min_x, min_y, max_x, max_y)`
+    :param zooms: zoom-levels for estimating
+    :param tiles_dir: optional path to directory for downloading
+    :param img_format: tiles images format
+    :param transport: transport for HTTP requests
+    :param sample_size: quantity of tiles fetched for every zoom-level
+    :param metrics: optional collector of downloading counters and timings
+    :return: estimates sorted by zoom-level
+    """
+    stats = dict() if tiles_dir is None else load_tiles_stats(tiles_dir).get(map_.__name__, dict())
+
+    estimates = list()
+    for zoom in sorted(set(zooms)):
+        tiles_num = map_.get_tiles_num(bbox, zoom)
+
+        tms_x_range, tms_y_range = map_.get_tms_ranges(bbox, zoom)
+        existent_tiles_tms = set() if tiles_dir is None else get_existent_tiles_tms(
+            tiles_dir, zoom, tms_x_range, tms_y_range, img_format
+        )
+
+        # with `len(existent_tiles_tms)` more candidates, at least `sample_size` of them are missing if possible
+        candidates_tms = (
+            (tms_x_range[i // len(tms_y_range)], tms_y_range[i % len(tms_y_range)])
+            for i in random.sample(range(tiles_num), min(sample_size + len(existent_tiles_tms), tiles_num))
+        )
+        sample = [
+            map_.Tile.from_tms(tms_x, tms_y, zoom)
+            for tms_x, tms_y in candidates_tms if (tms_x, tms_y) not in existent_tiles_tms
+        ][:sample_size]
+
+        sampled_tiles_num, sampled_bytes, saved_tiles_num = 0, 0, 0
+        start = time.perf_counter()
+        for tile, content in fetch_tiles(map_, sample, transport, metrics):
+            if content is None:
+                continue
+
+            sampled_tiles_num += 1
+            sampled_bytes += len(content)
+
+            path = None if tiles_dir is None else get_expected_path(tile, tiles_dir, img_format)
+            if path is not None and not path.exists() and map_.is_ok(content):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(content)
+                saved_tiles_num += 1
+        sampled_seconds = time.perf_counter() - start if sampled_tiles_num else 0.
+
+        if tiles_dir is not None and sampled_tiles_num:
+            update_tiles_stats(tiles_dir, map_, zoom, sampled_tiles_num, sampled_bytes, sampled_seconds)
+
+        zoom_stats = stats.get(str(zoom), dict())
+        known_tiles_num = sampled_tiles_num + zoom_stats.get('tiles', 0)
+        known_bytes = sampled_bytes + zoom_stats.get('bytes', 0)
+        known_seconds = sampled_seconds + zoom_stats.get('seconds', 0.)
+
+        estimates.append(DownloadEstimate(
+            map_name=map_.__name__,
+            zoom=zoom,
+            tiles_num=tiles_num,
+            missing_tiles_num=tiles_num - len(existent_tiles_tms) - saved_tiles_num,
+            avg_bytes_in_img=known_bytes / known_tiles_num if known_tiles_num else None,
+            avg_seconds_per_img=known_seconds / known_tiles_num if known_tiles_num else None
+        ))
+
+    return estimates
+
+
+def get_max_zoom_in_budget(
+        estimates: Iterable[DownloadEstimate],
+        max_bytes: Optional[float] = None,
+        max_seconds: Optional[float] = None
+) -> Optional[int]:
+    # language=rst
+    """
+    :param estimates: estimates of downloading for different zoom-levels
+    :param max_bytes: budget of downloaded bytes. If `None`, bytes are unlimited
+    :param max_seconds: budget of downloading time in seconds. If `None`, time is unlimited
+    :return: highest zoom-level, which estimated downloading fits in budget, or `None` if there is no such zoom-level
+    """
+    fitting_zooms = [
+        estimate.zoom for estimate in estimates
+        if (max_bytes is None or (estimate.total_bytes is not None and estimate.total_bytes <= max_bytes)) and
+           (max_seconds is None or (estimate.total_seconds is not None and estimate.total_seconds <= max_seconds))
+    ]
+    return max(fitting_zooms, default=None)
+
+
+def get_tiles_paths(
+        map_: Type[maps.Map],
+        google_x_range: range,
+        google_y_range: range,
+        zoom: int,
+        tiles_dir: Path,
+        img_format: ImageFormat
+) -> List[List[Path]]:
+    # language=rst
+    """
+    :return: rows of paths of existent tiles from given ranges of Google tile coordinates
+    """
+    paths = list()
+    for google_y in google_y_range:
+        row = list()
+        for google_x in google_x_range:
+            tile = map_.Tile.from_google(google_x, google_y, zoom)
+            path = get_expected_path(tile, tiles_dir, img_format)
+
+            if not path.exists():
+                raise Exception(f"Can't reach tile {tile.quad_tree}")
+
+            row.append(path)
+        paths.append(row)
+
+    return paths
+
+
 def get_tiles_data(
         map_: Type[maps.Map],
         corner_tiles: Tuple[BaseTile, BaseTile, BaseTile, BaseTile],
         tiles_dir: Path,
-        img_format: ImageFormat
-) -> np.ndarray:
+        img_format: ImageFormat,
+        metrics: Optional[Metrics] = None
+) -> Tuple[np.ndarray, PixelLayout]:
     # language=rst
     """
     Merge tiles from area between `corner_tiles` from `tiles_dir` with `zoom` zoom-level and `tiles_format` image format
@@ -95,33 +303,39 @@ def get_tiles_data(
     :param corner_tiles: Four corner tiles for rectangle tiles area
     :param tiles_dir: path to directory that contains necessary tiles
     :param img_format: tiles images format
-    :return: merged image data
+    :param metrics: optional collector of decoding timings
+    :return: merged band-major image data and its bands layout
     """
+    metrics = Metrics() if metrics is None else metrics
     zoom = corner_tiles[0].zoom
 
     _google_x_s, _google_y_s = zip(*(tile.google for tile in corner_tiles))
     min_x, min_y, max_x, max_y = min(_google_x_s), min(_google_y_s), max(_google_x_s), max(_google_y_s)
 
-    rows = list()
-    for google_y in range(min_y, max_y + 1):
-        row = list()
-        for google_x in range(min_x, max_x + 1):
-            tile = map_.Tile.from_google(google_x, google_y, zoom)
-            path = get_expected_path(tile, tiles_dir, img_format)
+    paths = get_tiles_paths(map_, range(min_x, max_x + 1), range(min_y, max_y + 1), zoom, tiles_dir, img_format)
 
-            if path.exists():
-                data = cv2.imread(str(path))
-            else:
-                raise Exception(f"Can't reach tile {tile.quad_tree}")
-                # data = np.array([[None, ] * map_.Tile.tile_size, ] * map_.Tile.tile_size)
-                # cv2.hconcat: TypeError: src data type = 17 is not supported
+    # every tile is opened once, so its header is collected together with its data
+    tiles = list()
+    for row in paths:
+        tiles.append(list())
+        for path in row:
+            with metrics.timer('decode'):
+                tiles[-1].append(read_tile(path))
+
+    layout = get_pixel_layout(header for row in tiles for _, header in row)
 
-            row.append(data)
+    tile_height, tile_width = tiles[0][0][1].height, tiles[0][0][1].width
+    data = np.empty((layout.count, len(paths) * tile_height, len(paths[0]) * tile_width), dtype=np.uint8)
 
-        row_img = cv2.hconcat(row)
-        rows.append(row_img)
+    for i, row in enumerate(tiles):
+        for j, (tile_data, header) in enumerate(row):
+            if tile_data.shape[1:] != (tile_height, tile_width):
+                raise Exception(f'Tiles of {map_.__name__} have different sizes')
 
-    return cv2.vconcat(rows)[:, :, ::-1]
+            data[:, i * tile_height:(i + 1) * tile_height, j * tile_width:(j + 1) * tile_width] = \
+                to_pixel_layout(tile_data, header.colormap, layout)
+
+    return data, layout
 
 
 def merge_in_gtiff(
@@ -130,7 +344,8 @@ def merge_in_gtiff(
         path: Path,
         tiles_dir: Path,
         img_format: ImageFormat,
-        projection: Optional[Proj] = None
+        projection: Optional[Proj] = None,
+        metrics: Optional[Metrics] = None
 ) -> None:
     # language=rst
     """
@@ -141,12 +356,14 @@ def merge_in_gtiff(
     :param tiles_dir: path to directory that contains necessary tiles
     :param img_format: tiles images format
     :param projection: projection for output GeoTIFF
+    :param metrics: optional collector of decoding and warping timings
     :return:
     """
+    metrics = Metrics() if metrics is None else metrics
     source_projection = map_.projection
     destination_projection = source_projection if projection is None else projection
 
-    data = get_tiles_data(map_, corner_tiles, tiles_dir, img_format)
+    data, layout = get_tiles_data(map_, corner_tiles, tiles_dir, img_format, metrics)
 
     _corner_tiles_bounds = sum((tile.bounds for tile in corner_tiles), tuple())
     _x_s, _y_s = zip(*_corner_tiles_bounds)
@@ -155,27 +372,169 @@ def merge_in_gtiff(
     meta = dict(
         driver='GTiff',
         crs=destination_projection.srs,
-        count=data.shape[2],
-        dtype=data.dtype
+        **get_gtiff_options(layout)
     )
 
     meta['transform'], meta['width'], meta['height'] = rio.warp.calculate_default_transform(
         source_projection.srs, destination_projection.srs,
-        data.shape[1], data.shape[0],
+        data.shape[2], data.shape[1],
         left, bottom, right, top
     )
 
-    src_transform = rio.transform.from_bounds(left, bottom, right, top, data.shape[1], data.shape[0])
-    with rio.open(path, 'w', **meta) as destination_img:
+    src_transform = rio.transform.from_bounds(left, bottom, right, top, data.shape[2], data.shape[1])
+    with metrics.timer('warp'), rio.open(path, 'w', **meta) as destination_img:
+        write_colormap(destination_img, layout)
+
         for i in range(meta['count']):
             rio.warp.reproject(
-                data.take(i, 2),
+                data[i],
                 rio.band(destination_img, i + 1),
                 src_transform=src_transform,
-                src_crs=source_projection.srs
+                src_crs=source_projection.srs,
+                src_nodata=layout.nodata
             )
 
 
+def place_in_gtiff(
+        map_: Type[maps.Map],
+        corner_tiles: Tuple[BaseTile, BaseTile, BaseTile, BaseTile],
+        bbox: Tuple[float, float, float, float],
+        path: Path,
+        tiles_dir: Path,
+        img_format: ImageFormat,
+        metrics: Optional[Metrics] = None
+) -> None:
+    # language=rst
+    """
+    Write tiles from area between `corner_tiles` from `tiles_dir` directly into their windows of GeoTIFF file
+    with `path`, cropped to `bbox`, in `map_.projection` without merging and reprojection of the whole area.
+    Only tiles intersecting `bbox` are decoded.
+    :param map_: maps.Map subclass, which tiles will be downloaded
+    :param corner_tiles: Four corner tiles for rectangle tiles area
+    :param bbox: bbox of area coordinates in `map_.projection` reference system in from
+    `(min_x, min_y, max_x, max_y)`
+    :param path: path for output GeoTIFF
+    :param tiles_dir: path to directory that contains necessary tiles
+    :param img_format: tiles images format
+    :param metrics: optional collector of decoding and placing timings
+    :return:
+    """
+    metrics = Metrics() if metrics is None else metrics
+    zoom = corner_tiles[0].zoom
+
+    _google_x_s, _google_y_s = zip(*(tile.google for tile in corner_tiles))
+    min_x, min_y, max_x, max_y = min(_google_x_s), min(_google_y_s), max(_google_x_s), max(_google_y_s)
+
+    _corner_tiles_bounds = sum((tile.bounds for tile in corner_tiles), tuple())
+    _x_s, _y_s = zip(*_corner_tiles_bounds)
+    left, right, bottom, top = min(_x_s), max(_x_s), min(_y_s), max(_y_s)
+
+    first_tile_header = get_tile_header(get_tiles_paths(
+        map_, range(min_x, min_x + 1), range(min_y, min_y + 1), zoom, tiles_dir, img_format
+    )[0][0])
+    tile_height, tile_width = first_tile_header.height, first_tile_header.width
+    width, height = (max_x - min_x + 1) * tile_width, (max_y - min_y + 1) * tile_height
+    area_transform = rio.transform.from_bounds(left, bottom, right, top, width, height)
+
+    # pixels containing `bbox`, as `rio.mask.mask` with `crop=True` does
+    col_start = max(0, math.floor((bbox[0] - left) / area_transform.a))
+    col_stop = min(width, math.ceil((bbox[2] - left) / area_transform.a))
+    row_start = max(0, math.floor((bbox[3] - top) / area_transform.e))
+    row_stop = min(height, math.ceil((bbox[1] - top) / area_transform.e))
+
+    google_x_range = range(min_x + col_start // tile_width, min_x + (col_stop - 1) // tile_width + 1)
+    google_y_range = range(min_y + row_start // tile_height, min_y + (row_stop - 1) // tile_height + 1)
+    paths = get_tiles_paths(map_, google_x_range, google_y_range, zoom, tiles_dir, img_format)
+    # tiles are decoded one by one while writing, so the layout is chosen by their palettes scanned without decoding
+    layout = get_pixel_layout(get_tile_header(path) for row in paths for path in row)
+
+    meta = dict(
+        driver='GTiff',
+        crs=map_.projection.srs,
+        width=col_stop - col_start,
+        height=row_stop - row_start,
+        transform=area_transform * rio.transform.Affine.translation(col_start, row_start),
+        **get_gtiff_options(layout)
+    )
+
+    with rio.open(path, 'w', **meta) as destination_img:
+        write_colormap(destination_img, layout)
+
+        for google_y, row in zip(google_y_range, paths):
+            for google_x, tile_path in zip(google_x_range, row):
+                with metrics.timer('decode'):
+                    data, header = read_tile(tile_path)
+
+                if data.shape[1:] != (tile_height, tile_width):
+                    raise Exception(f'Tiles of {map_.__name__} have different sizes')
+
+                tile_col, tile_row = (google_x - min_x) * tile_width, (google_y - min_y) * tile_height
+                cols = slice(max(col_start, tile_col), min(col_stop, tile_col + tile_width))
+                rows = slice(max(row_start, tile_row), min(row_stop, tile_row + tile_height))
+
+                tile_rows = slice(rows.start - tile_row, rows.stop - tile_row)
+                tile_cols = slice(cols.start - tile_col, cols.stop - tile_col)
+
+                with metrics.timer('place'):
+                    destination_img.write(
+                        to_pixel_layout(data[:, tile_rows, tile_cols], header.colormap, layout),
+                        window=rio.windows.Window(
+                            cols.start - col_start, rows.start - row_start,
+                            cols.stop - cols.start, rows.stop - rows.start
+                        )
+                    )
+
+
+def merge_and_crop_in_gtiff(
+        map_: Type[maps.Map],
+        corner_tiles: Tuple[BaseTile, BaseTile, BaseTile, BaseTile],
+        bbox: Tuple[float, float, float, float],
+        path: Path,
+        tiles_dir: Path,
+        img_format: ImageFormat,
+        projection: Optional[Proj] = None,
+        metrics: Optional[Metrics] = None
+) -> None:
+    # language=rst
+    """
+    Merge tiles from area between `corner_tiles` from `tiles_dir` in GeoTIFF with `projection`
+    and crop it to `bbox` in GeoTIFF file with `path`
+    :param map_: maps.Map subclass, which tiles will be downloaded
+    :param corner_tiles: Four corner tiles for rectangle tiles area
+    :param bbox: bbox of area coordinates in `projection` reference system in from
+    `(min_x, min_y, max_x, max_y)`
+    :param path: path for output GeoTIFF
+    :param tiles_dir: path to directory that contains necessary tiles
+    :param img_format: tiles images format
+    :param projection: projection for output GeoTIFF
+    :param metrics: optional collector of decoding, warping and cropping timings
+    :return:
+    """
+    metrics = Metrics() if metrics is None else metrics
+
+    with tempfile.NamedTemporaryFile(suffix='.tiff') as uncut_file:
+        merge_in_gtiff(map_, corner_tiles, uncut_file.name, tiles_dir, img_format, projection, metrics)
+
+        with metrics.timer('crop'), rio.open(uncut_file.name) as img:
+            meta = img.meta.copy()
+            layout = get_layout_of_gtiff(img)
+
+            # pixels partially covered by `bbox` are kept, as `place_in_gtiff` keeps them
+            cropped_data, meta['transform'] = rio.mask.mask(
+                img, [Polygon.from_bounds(*bbox), ], crop=True, all_touched=True
+            )
+
+    meta.update(get_gtiff_options(layout))
+    meta['height'], meta['width'] = cropped_data.shape[-2:]
+    with rio.open(path, 'w', **meta) as file:
+        write_colormap(file, layout)
+        file.write(cropped_data)
+
+
+def is_same_projection(projection: Proj, other_projection: Proj) -> bool:
+    return rio.crs.CRS.from_string(projection.srs) == rio.crs.CRS.from_string(other_projection.srs)
+
+
 def construct_gtiff(
         map_: Type[maps.Map],
         bbox: Tuple[float, float, float, float],
@@ -185,11 +544,13 @@ def construct_gtiff(
         img_format: ImageFormat,
         projection: Optional[Proj] = None,
         *,
-        printing=False
+        printing=False,
+        metrics: Optional[Metrics] = None
 ) -> None:
     # language=rst
     """
-    Construct GeoTIFF file with `bbox` area for `map_` tiles from `tiles_dir` with `zoom` zoom-level
+    Construct GeoTIFF file with `bbox` area for `map_` tiles from `tiles_dir` with `zoom` zoom-level.
+    If `projection` is the same as `map_.projection`, tiles are written in place without reprojection
     :param map_: maps.Map subclass, which tiles will be downloaded
     :param bbox: bbox of area coordinates in `projection` reference system in from
     `(min_x, min_y, max_x, max_y)`
@@ -199,8 +560,10 @@ def construct_gtiff(
     :param img_format: tiles images format
     :param projection: projection for output GeoTIFF
     :param printing: if `True`, will print info. Default -- `False`
+    :param metrics: optional collector of decoding, placing, warping and cropping timings
     :return:
     """
+    metrics = Metrics() if metrics is None else metrics
 
     if printing:
         print(f'Constructing GeoTiff to {path} ...')
@@ -211,20 +574,14 @@ def construct_gtiff(
     )
     corner_tiles = map_.get_corner_tiles(map_projection_bbox, zoom)
 
-    with tempfile.NamedTemporaryFile(suffix='.tiff') as uncut_file:
-        merge_in_gtiff(map_, corner_tiles, uncut_file.name, tiles_dir, img_format, projection)
+    if projection is None or is_same_projection(projection, map_.projection):
+        place_in_gtiff(map_, corner_tiles, bbox, path, tiles_dir, img_format, metrics)
 
-        with rio.open(uncut_file.name) as img:
-            meta = img.meta.copy()
+        if printing:
+            print(f'done. {humanize.naturalsize(path.stat().st_size)}')
+        return
 
-            cropped_data, meta['transform'] = rio.mask.mask(
-                img, [Polygon.from_bounds(*bbox), ], crop=True
-            )
-
-    meta['height'], meta['width'] = cropped_data.shape[-2:]
-    with rio.open(path, 'w', **meta) as file:
-        for i in range(meta['count']):
-            file.write(cropped_data[i], i + 1)
+    merge_and_crop_in_gtiff(map_, corner_tiles, bbox, path, tiles_dir, img_format, projection, metrics)
 
     if printing:
         print(f'done. {humanize.naturalsize(path.stat().st_size)}')
@@ -237,11 +594,14 @@ def download_in_gtiff(
         path: Path,
         tiles_dir: Union[str, Path, None],
         img_format: ImageFormat,
-        session: requests.Session,
+        transport: Transport,
         projection: Optional[Proj] = None,
         *,
+        order: TileOrder = TileOrder.HILBERT,
+        preview_zooms: Iterable[int] = (),
         overwriting=False,
-        printing=False
+        printing=False,
+        metrics: Optional[Metrics] = None
 ) -> None:
     # language=rst
     """
@@ -253,11 +613,15 @@ def download_in_gtiff(
     :param path: path for output GeoTIFF
     :param tiles_dir: path to directory that contains necessary tiles
     :param img_format: tiles images format
-    :param session: object providing requests session
+    :param transport: transport for HTTP requests
     :param projection: projection for output GeoTIFF
+    :param order: order of tiles downloading
+    :param preview_zooms: zoom-levels lower than `zoom`, which are downloaded first, from the coarsest one.
+    For every of them GeoTIFF is constructed at `path` with `_zoom_{zoom}` suffix of the name
     :param overwriting:  if `True`, will overwrite files with expected tiles names.
     if `False`, will skip existent files with expected tiles names.
     :param printing: if `True`, will print info. Default -- `False`
+    :param metrics: optional collector of downloading and constructing counters and timings
     :return:
     """
     map_bbox = bbox if projection is None else (
@@ -265,5 +629,24 @@ def download_in_gtiff(
         transform(projection, map_.projection, *bbox[2:])
     )
 
-    download_tiles(map_, map_bbox, zoom, tiles_dir, img_format, session, overwriting=overwriting, printing=printing)
-    construct_gtiff(map_, bbox, zoom, path, tiles_dir, img_format, projection, printing=printing)
+    preview_zooms = sorted(set(preview_zooms))
+    if any(preview_zoom >= zoom for preview_zoom in preview_zooms):
+        raise Exception('preview zoom-level should be lower than zoom-level')
+
+    for preview_zoom in preview_zooms:
+        preview_path = path.with_name(f'{path.stem}_zoom_{preview_zoom}{path.suffix}')
+
+        download_tiles(
+            map_, map_bbox, preview_zoom, tiles_dir, img_format, transport,
+            order=order, overwriting=overwriting, printing=printing, metrics=metrics
+        )
+        construct_gtiff(
+            map_, bbox, preview_zoom, preview_path, tiles_dir, img_format, projection,
+            printing=printing, metrics=metrics
+        )
+
+    download_tiles(
+        map_, map_bbox, zoom, tiles_dir, img_format, transport,
+        order=order, overwriting=overwriting, printing=printing, metrics=metrics
+    )
+    construct_gtiff(map_, bbox, zoom, path, tiles_dir, img_format, projection, printing=printing, metrics=metrics)
@@ -0,0 +1,75 @@
+"""
+Benchmark of GeoTIFF constructing without reprojection: `place_in_gtiff`, which writes tiles into their windows,
+against `merge_and_crop_in_gtiff`, which merges the whole tiles area and crops it with `rio.mask.mask`,
+as `construct_gtiff` did before.
+
+Tiles are generated in a temporary directory, run from the repository root:
+    PYTHONPATH=. python benchmarks/gtiff.py --size 48 --repeats 3
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio as rio
+
+import maps
+from _tile_downloader import merge_and_crop_in_gtiff, place_in_gtiff
+from utils import ImageFormat, get_expected_path
+
+
+def write_tiles(map_, size, zoom, tiles_dir, img_format):
+    random = np.random.default_rng(0)
+    for google_y in range(size):
+        for google_x in range(size):
+            path = get_expected_path(map_.Tile.from_google(google_x, google_y, zoom), tiles_dir, img_format)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # smooth noise, so tiles are compressed like real ones
+            data = np.cumsum(random.integers(0, 3, (3, 256, 256), dtype=np.uint8), axis=2, dtype=np.uint8)
+            with rio.open(path, 'w', driver='PNG', width=256, height=256, count=3, dtype='uint8') as img:
+                img.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=48, help='side of tiles area in tiles')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    map_, zoom, img_format = maps.OpenStreetMap, 10, ImageFormat.PNG
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tiles_dir = Path(tmp_dir).joinpath('tiles')
+        write_tiles(map_, args.size, zoom, tiles_dir, img_format)
+
+        (left, bottom), _ = map_.Tile.from_google(0, args.size - 1, zoom).bounds
+        _, (right, top) = map_.Tile.from_google(args.size - 1, 0, zoom).bounds
+        # bbox is a bit smaller than tiles area and its edges cut pixels, so both ways crop it
+        margin = (right - left) / args.size * 0.37
+        bbox = (left + margin, bottom + margin, right - margin, top - margin)
+        corner_tiles = map_.get_corner_tiles(bbox, zoom)
+
+        print(f'{args.size}x{args.size} tiles of 256x256 px, best of {args.repeats} runs:')
+        results = dict()
+        for construct in (merge_and_crop_in_gtiff, place_in_gtiff):
+            name = construct.__name__
+            path = Path(tmp_dir).joinpath(f'{name}.tiff')
+
+            seconds = list()
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                construct(map_, corner_tiles, bbox, path, tiles_dir, img_format)
+                seconds.append(time.perf_counter() - start)
+
+            with rio.open(path) as img:
+                results[name] = img.read()
+            print(f'    {name:<24}{min(seconds):8.3f} s')
+
+        first, second = results.values()
+        print('outputs are equal' if np.array_equal(first, second) else 'outputs differ')
+
+
+if __name__ == '__main__':
+    main()
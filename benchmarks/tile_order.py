@@ -0,0 +1,61 @@
+"""
+Simulation of tiles orders locality with `utils.TileOrder.get_xy_gen`:
+* upstream cache hit rate -- share of tiles, which meta-tile is in LRU cache of the tiles server,
+as map services render and cache tiles by meta-tiles
+* mean row jump -- mean distance in tiles rows between consecutive tiles, which are written to a GeoTIFF by rows
+* generation time of the whole order
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/tile_order.py --size 256
+"""
+import argparse
+import time
+from collections import OrderedDict
+
+from utils import TileOrder
+
+
+def get_hit_rate(xy_s, meta_size, cache_size):
+    cache, hits = OrderedDict(), 0
+    for x, y in xy_s:
+        meta_tile = x // meta_size, y // meta_size
+        if meta_tile in cache:
+            hits += 1
+            cache.move_to_end(meta_tile)
+        else:
+            cache[meta_tile] = None
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+
+    return hits / len(xy_s)
+
+
+def get_mean_row_jump(xy_s):
+    return sum(abs(y - previous_y) for (_, previous_y), (_, y) in zip(xy_s, xy_s[1:])) / (len(xy_s) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=256, help='side of tiles area in tiles')
+    parser.add_argument('--offset', type=int, default=1000, help='Google x and y of top left tile of the area')
+    parser.add_argument('--meta-size', type=int, default=8, help='side of upstream meta-tile in tiles')
+    parser.add_argument('--cache-size', type=int, default=16, help='quantity of meta-tiles in upstream cache')
+    args = parser.parse_args()
+
+    x_range = range(args.offset, args.offset + args.size)
+    y_range = range(args.offset, args.offset + args.size)
+
+    print(f'{args.size}x{args.size} tiles, {args.meta_size}x{args.meta_size} meta-tiles, '
+          f'cache of {args.cache_size} meta-tiles:')
+    print(f'    {"order":<10}{"hit rate":>10}{"row jump":>10}{"ms":>10}')
+    for order in TileOrder:
+        start = time.perf_counter()
+        xy_s = list(order.get_xy_gen(x_range, y_range))
+        milliseconds = (time.perf_counter() - start) * 1000
+
+        hit_rate = get_hit_rate(xy_s, args.meta_size, args.cache_size)
+        print(f'    {order.name:<10}{hit_rate:>10.3f}{get_mean_row_jump(xy_s):>10.2f}{milliseconds:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ from darkgeotile import BaseTile, get_tile_class
 
 from pyproj import Proj
 
+from utils import TileOrder
+
 
 class Map(ABC):
     """
@@ -41,12 +43,36 @@ class Map(ABC):
         return 0
 
     @classmethod
-    def get_tile_gen(cls, bbox: Tuple[float, float, float, float], zoom: int) -> Generator[Type[BaseTile], None, None]:
+    def get_tile_gen(
+            cls,
+            bbox: Tuple[float, float, float, float],
+            zoom: int,
+            order: TileOrder = TileOrder.TMS
+    ) -> Generator[Type[BaseTile], None, None]:
+        # language=rst
+        """
+        Returns generator of tiles covering `bbox` with `zoom` zoom-level in `order`
+        """
+        _google_x_s, _google_y_s = zip(*(tile.google for tile in cls.get_corner_tiles(bbox, zoom)))
+        google_x_range = range(min(_google_x_s), max(_google_x_s) + 1)
+        google_y_range = range(min(_google_y_s), max(_google_y_s) + 1)
+
+        for x, y in order.get_xy_gen(google_x_range, google_y_range):
+            yield cls.Tile.from_google(x, y, zoom)
+
+    @classmethod
+    def get_tms_ranges(cls, bbox: Tuple[float, float, float, float], zoom: int) -> Tuple[range, range]:
+        # language=rst
+        """
+        Returns ranges of TMS x and y coordinates of tiles covering `bbox` with `zoom` zoom-level
+        """
         tms_x_s, tms_y_s = zip(*[tile.tms for tile in cls.get_corner_tiles(bbox, zoom)])
+        return range(min(tms_x_s), max(tms_x_s) + 1), range(min(tms_y_s), max(tms_y_s) + 1)
 
-        for x in range(min(tms_x_s), max(tms_x_s) + 1):
-            for y in range(min(tms_y_s), max(tms_y_s) + 1):
-                yield cls.Tile.from_tms(x, y, zoom)
+    @classmethod
+    def get_tiles_num(cls, bbox: Tuple[float, float, float, float], zoom: int) -> int:
+        tms_x_range, tms_y_range = cls.get_tms_ranges(bbox, zoom)
+        return len(tms_x_range) * len(tms_y_range)
 
     @classmethod
     def get_corner_tiles(cls, bbox, zoom):
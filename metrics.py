@@ -0,0 +1,201 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Generator, List, Tuple, Union
+
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf)
+
+Labels = Tuple[Tuple[str, str], ...]
+Hook = Callable[[str, str, float, Dict[str, str]], None]
+
+
+def _get_labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed upper bounds of buckets in milliseconds.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        self.counts = [0, ] * len(buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    def get_cumulative_counts(self) -> List[int]:
+        cumulative_counts, total = list(), 0
+        for count in self.counts:
+            total += count
+            cumulative_counts.append(total)
+
+        return cumulative_counts
+
+
+class Metrics:
+    """
+    Collector of counters and latency histograms for tiles downloading and GeoTIFF constructing.
+
+    Every counter and histogram is identified with name and labels, e.g. `mirror` host or response `status`.
+    Hooks, added with `add_hook`, are called on every event as `hook(kind, name, value, labels)`,
+    where `kind` is `'counter'` or `'histogram'`.
+
+    Collected by downloading:
+        requests_total, responses_total, network_errors_total, failed_requests_total, retries_total, bytes_total,
+        blank_tiles_total, skipped_tiles_total counters, where failed_requests_total counts both error responses
+        and network errors, and retries_total counts failed requests followed by the next mirror request,
+        and request_ms, ttfb_ms, transfer_ms, write_ms histograms
+    Collected by GeoTIFF constructing:
+        decode_ms, place_ms, warp_ms, crop_ms histograms
+    """
+
+    def __init__(self, prefix: str = 'tile_downloader', buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS) -> None:
+        self.prefix = prefix
+        self.buckets = buckets
+
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = dict()
+        self.hooks: List[Hook] = list()
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        self.hooks.append(hook)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self.counters[name, _get_labels(labels)] += value
+
+        for hook in self.hooks:
+            hook('counter', name, value, labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = name, _get_labels(labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+
+            self.histograms[key].observe(value)
+
+        for hook in self.hooks:
+            hook('histogram', name, value, labels)
+
+    def get_snapshot(self) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], Histogram]]:
+        # language=rst
+        """
+        :return: consistent copies of counters and histograms, taken under the lock,
+        as they can be updated from other threads during exporting
+        """
+        with self._lock:
+            return dict(self.counters), {key: histogram.copy() for key, histogram in self.histograms.items()}
+
+    @contextmanager
+    def timer(self, stage: str, **labels) -> Generator[None, None, None]:
+        # language=rst
+        """
+        Observe execution time of the block in milliseconds as `{stage}_ms` histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f'{stage}_ms', (time.perf_counter() - start) * 1000, **labels)
+
+    def to_json_lines(self) -> str:
+        # language=rst
+        """
+        :return: one JSON object per counter and per histogram, separated with new lines
+        """
+        counters, histograms = self.get_snapshot()
+        lines = list()
+
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(json.dumps(dict(type='counter', name=name, labels=dict(labels), value=value)))
+
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            lines.append(json.dumps(dict(
+                type='histogram',
+                name=name,
+                labels=dict(labels),
+                count=histogram.count,
+                sum=histogram.sum,
+                buckets={str(bound): count for bound, count in zip(histogram.buckets, histogram.counts)}
+            )))
+
+        return '\n'.join(lines) + '\n'
+
+    def to_prometheus(self) -> str:
+        # language=rst
+        """
+        :return: metrics in Prometheus text exposition format
+        """
+        def format_labels(labels, **extra_labels):
+            pairs = list(labels) + sorted(extra_labels.items())
+            pairs = [f'{key}="{_escape_label_value(value)}"' for key, value in pairs]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        counters, histograms = self.get_snapshot()
+        lines = list()
+
+        typed_names = set()
+        for (name, labels), value in sorted(counters.items()):
+            full_name = f'{self.prefix}_{name}'
+            if full_name not in typed_names:
+                lines.append(f'# TYPE {full_name} counter')
+                typed_names.add(full_name)
+            lines.append(f'{full_name}{format_labels(labels)} {value:g}')
+
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            full_name = f'{self.prefix}_{name}'
+            if full_name not in typed_names:
+                lines.append(f'# TYPE {full_name} histogram')
+                typed_names.add(full_name)
+
+            for bound, count in zip(histogram.buckets, histogram.get_cumulative_counts()):
+                le = '+Inf' if math.isinf(bound) else f'{bound:g}'
+                lines.append(f'{full_name}_bucket{format_labels(labels, le=le)} {count}')
+            lines.append(f'{full_name}_sum{format_labels(labels)} {histogram.sum:g}')
+            lines.append(f'{full_name}_count{format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: Union[Path, str], fmt: str = 'jsonl') -> None:
+        # language=rst
+        """
+        Write metrics to `path`
+        :param path: path for output file
+        :param fmt: `'jsonl'` for JSON lines or `'prometheus'` for Prometheus text format
+        :return:
+        """
+        if fmt == 'jsonl':
+            text = self.to_json_lines()
+        elif fmt == 'prometheus':
+            text = self.to_prometheus()
+        else:
+            raise Exception('unknown metrics format')
+
+        Path(path).write_text(text)
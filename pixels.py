@@ -0,0 +1,198 @@
+import warnings
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+import rasterio as rio
+from rasterio.enums import ColorInterp
+from rasterio.errors import NotGeoreferencedWarning
+
+Colormap = Dict[int, Tuple[int, int, int, int]]
+ColormapKey = Tuple[Tuple[int, Tuple[int, int, int, int]], ...]
+
+TRANSPARENT = (0, 0, 0, 0)
+
+
+class PaletteOverflowWarning(UserWarning):
+    """
+    Indexed tiles are merged as RGB, as their palettes have more than 256 different colors in total
+    """
+
+
+class TileHeader(NamedTuple):
+    count: int
+    height: int
+    width: int
+    has_alpha: bool
+    colormap: Optional[Colormap]
+
+
+class PixelLayout(NamedTuple):
+    # language=rst
+    """
+    Bands layout of merged tiles data:
+    * indexed -- `count` is 1, `colormap` is palette merged from tiles palettes, `luts` map indexes of every
+    tile palette, given by `get_colormap_key`, to indexes of merged palette, `nodata` is transparent index,
+    which is added to merged palette if tiles palettes have none of them and there is room for it
+    * RGB or RGBA -- `count` is 3 or 4, where the 4th band is alpha
+    """
+    count: int
+    colormap: Optional[Colormap] = None
+    nodata: Optional[int] = None
+    luts: Optional[Dict[ColormapKey, np.ndarray]] = None
+
+
+def _open_tile(path: Path):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', NotGeoreferencedWarning)
+        return rio.open(path)
+
+
+def _get_colormap(img) -> Optional[Colormap]:
+    return img.colormap(1) if img.count == 1 and img.colorinterp[0] == ColorInterp.palette else None
+
+
+def get_colormap_key(colormap: Colormap) -> ColormapKey:
+    return tuple(sorted(colormap.items()))
+
+
+def _get_tile_header(img) -> TileHeader:
+    return TileHeader(img.count, img.height, img.width, ColorInterp.alpha in img.colorinterp, _get_colormap(img))
+
+
+def get_tile_header(path: Path) -> TileHeader:
+    # language=rst
+    """
+    :param path: path to tile image
+    :return: bands count, size, alpha presence and palette of tile image, without its decoding
+    """
+    with _open_tile(path) as img:
+        return _get_tile_header(img)
+
+
+def read_tile(path: Path) -> Tuple[np.ndarray, TileHeader]:
+    # language=rst
+    """
+    :param path: path to tile image
+    :return: contiguous band-major tile data with native bands, and tile header, read with the same opening
+    """
+    with _open_tile(path) as img:
+        return img.read(), _get_tile_header(img)
+
+
+def _merge_colormaps(colormaps: Iterable[Colormap]) -> Optional[Tuple[Colormap, Dict[ColormapKey, np.ndarray]]]:
+    colors: Dict[Tuple[int, int, int, int], int] = dict()
+    luts = dict()
+
+    for colormap in colormaps:
+        lut = np.zeros(256, dtype=np.uint8)
+        for index, color in colormap.items():
+            color = TRANSPARENT if color[3] == 0 else tuple(color)
+            if color not in colors:
+                if len(colors) == 256:
+                    return None
+                colors[color] = len(colors)
+
+            lut[index] = colors[color]
+        luts[get_colormap_key(colormap)] = lut
+
+    return {index: color for color, index in colors.items()}, luts
+
+
+def get_pixel_layout(headers: Iterable[TileHeader]) -> PixelLayout:
+    # language=rst
+    """
+    Choose the most compact bands layout, keeping all tiles colors and transparency.
+    Tiles are kept indexed, if all of them are indexed, their palettes have no more than 256 different colors
+    and no semi-transparent colors. Palettes aren't quantized, so if indexed tiles have more colors in total,
+    as tiles of maps with own palette for every tile often do, `PaletteOverflowWarning` is issued
+    and tiles are merged as RGB or RGBA.
+    :param headers: headers of merged tiles
+    :return: layout of merged tiles data
+    """
+    headers = list(headers)
+    colormaps = {get_colormap_key(h.colormap): h.colormap for h in headers if h.colormap is not None}
+
+    if colormaps and all(header.colormap is not None for header in headers):
+        merged = _merge_colormaps(colormaps.values())
+        if merged is None:
+            warnings.warn(
+                f'{len(colormaps)} palettes of indexed tiles have more than 256 colors, '
+                f'tiles are merged without palette',
+                PaletteOverflowWarning
+            )
+        else:
+            colormap, luts = merged
+            if all(color[3] in (0, 255) for color in colormap.values()):
+                nodata = next((index for index, color in colormap.items() if color == TRANSPARENT), None)
+                # areas without tiles data, e.g. filled by warping, shouldn't get a real map color
+                if nodata is None and len(colormap) < 256:
+                    nodata = len(colormap)
+                    colormap[nodata] = TRANSPARENT
+                return PixelLayout(1, colormap, nodata, luts)
+
+    has_alpha = any(header.has_alpha for header in headers) or any(
+        color[3] < 255 for colormap in colormaps.values() for color in colormap.values()
+    )
+    return PixelLayout(4 if has_alpha else 3)
+
+
+def to_pixel_layout(data: np.ndarray, colormap: Optional[Colormap], layout: PixelLayout) -> np.ndarray:
+    # language=rst
+    """
+    :param data: band-major tile data, returned by `read_tile`
+    :param colormap: palette of indexed tile from its header
+    :param layout: layout of merged tiles data
+    :return: contiguous band-major tile data with `layout.count` bands
+    """
+    if layout.colormap is not None:
+        return layout.luts[get_colormap_key(colormap)][data]
+
+    if colormap is not None:
+        lut = np.array([colormap.get(index, TRANSPARENT) for index in range(256)], dtype=np.uint8)
+        return np.ascontiguousarray(np.moveaxis(lut[data[0]], -1, 0)[:layout.count])
+
+    if data.shape[0] <= 2:
+        data = np.concatenate([data[:1], data[:1], data[:1], data[1:]])
+
+    if data.shape[0] < layout.count:
+        data = np.concatenate([data, np.full_like(data[:1], 255)])
+
+    return np.ascontiguousarray(data[:layout.count])
+
+
+def get_gtiff_options(layout: PixelLayout) -> dict:
+    # language=rst
+    """
+    :param layout: layout of merged tiles data
+    :return: GeoTIFF meta and creation options for `layout`. Alpha band is marked as alpha,
+    so it's used as mask band
+    """
+    options = dict(count=layout.count, dtype='uint8', nodata=layout.nodata)
+
+    if layout.count == 1:
+        options['photometric'] = 'PALETTE'
+    else:
+        options['photometric'] = 'RGB'
+        if layout.count == 4:
+            options['alpha'] = 'YES'
+
+    return options
+
+
+def write_colormap(img, layout: PixelLayout) -> None:
+    # language=rst
+    """
+    Write merged palette of indexed `layout` to opened for writing GeoTIFF
+    """
+    if layout.colormap is not None:
+        img.write_colormap(1, layout.colormap)
+
+
+def get_layout_of_gtiff(img) -> PixelLayout:
+    # language=rst
+    """
+    :param img: opened GeoTIFF, written with `get_gtiff_options`
+    :return: layout of its data, without palettes luts
+    """
+    return PixelLayout(img.count, _get_colormap(img), img.nodata)
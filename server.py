@@ -0,0 +1,269 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Type, Union
+
+from darkgeotile import BaseTile
+
+import maps
+from _tile_downloader import fetch_tiles
+from metrics import Metrics
+from transport import Transport
+from utils import ImageFormat, get_expected_path
+
+
+class TileCache:
+    """
+    Local tiles store, which fetches missing and expired tiles from upstream map services.
+
+    Tiles of every map are stored in `tiles_dir/{map name}` with `utils.get_expected_path` layout,
+    so the store can be filled in advance with `tile_downloader.download_tiles`.
+    Concurrent requests of the same missing tile share one upstream fetch.
+    If the store exceeds `max_bytes`, least recently used tiles are deleted.
+    Access time of the tile file is used as its last usage time, and modification time as its fetching time.
+    Tiles, which aren't ok for their map, e.g. blank "no imagery" tiles, aren't stored,
+    but an empty marker file with `.blank` suffix is written instead, so they aren't fetched again until `ttl` expires.
+    """
+
+    def __init__(
+            self,
+            tiles_dir: Union[Path, str],
+            transport: Transport,
+            img_format: ImageFormat = ImageFormat.PNG,
+            *,
+            max_bytes: Optional[int] = None,
+            ttl: Optional[float] = None,
+            metrics: Optional[Metrics] = None
+    ) -> None:
+        # language=rst
+        """
+        :param tiles_dir: path to directory of the store
+        :param transport: transport for upstream HTTP requests. It should be safe for using from several threads
+        :param img_format: tiles images format
+        :param max_bytes: maximum size of the store. If `None`, size is unlimited
+        :param ttl: quantity of seconds, after which stored tile is fetched again. If `None`, tiles don't expire
+        :param metrics: optional collector of caching and downloading counters and timings
+        """
+        self.tiles_dir = Path(tiles_dir)
+        self.transport = transport
+        self.img_format = img_format
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self._lock = threading.RLock()
+        self._pending: Dict[Path, Future] = dict()
+
+        files = [
+            (path, path.stat()) for path in self.tiles_dir.rglob(f'*{img_format.suffix}')
+        ] if self.tiles_dir.exists() else list()
+        self._sizes: OrderedDict = OrderedDict(
+            (path, stat.st_size) for path, stat in sorted(files, key=lambda item: item[1].st_atime)
+        )
+        self._total_bytes = sum(self._sizes.values())
+
+    def get_path(self, map_: Type[maps.Map], tile: BaseTile) -> Path:
+        return get_expected_path(tile, self.tiles_dir.joinpath(map_.__name__), self.img_format)
+
+    def get(self, map_: Type[maps.Map], tile: BaseTile) -> Optional[bytes]:
+        # language=rst
+        """
+        :param map_: maps.Map subclass, which tile is requested
+        :param tile: requested tile
+        :return: tile image as `bytes`, or `None` if the tile can't be fetched or isn't ok for `map_`
+        """
+        path = self.get_path(map_, tile)
+
+        found, content = self._lookup(path)
+        if not found:
+            with self._lock:
+                future = self._pending.get(path)
+                fetching = future is None
+                if fetching:
+                    # the tile could be written by just finished fetch after the first lookup
+                    found, content = self._lookup(path, counting=False)
+                    if not found:
+                        future = self._pending[path] = Future()
+
+        if found:
+            self.metrics.inc('cache_hits_total' if content is not None else 'blank_hits_total', map=map_.__name__)
+            return content
+
+        if not fetching:
+            self.metrics.inc('coalesced_requests_total', map=map_.__name__)
+            return future.result()
+
+        self.metrics.inc('cache_misses_total', map=map_.__name__)
+        try:
+            _, content = next(fetch_tiles(map_, [tile, ], self.transport, self.metrics))
+            if content is not None and map_.is_ok(content):
+                self._write(path, content)
+            elif content is not None:
+                self._write_blank(path)
+                content = None
+
+            future.set_result(content)
+            return content
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[path]
+
+    @staticmethod
+    def _get_blank_path(path: Path) -> Path:
+        return path.with_name(f'{path.name}.blank')
+
+    def _lookup(self, path: Path, counting: bool = True) -> Tuple[bool, Optional[bytes]]:
+        # language=rst
+        """
+        :return: if the tile is found, and its content, which is `None` for not expired blank tile
+        """
+        content = self._read(path, counting)
+        if content is not None:
+            return True, content
+
+        try:
+            blank_stat = self._get_blank_path(path).stat()
+        except FileNotFoundError:
+            return False, None
+
+        return self.ttl is None or time.time() - blank_stat.st_mtime <= self.ttl, None
+
+    def _read(self, path: Path, counting: bool = True) -> Optional[bytes]:
+        try:
+            stat = path.stat()
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                if counting:
+                    self.metrics.inc('expired_tiles_total')
+                return None
+
+            with self.metrics.timer('read'):
+                content = path.read_bytes()
+
+            # access time is set explicitly, as file systems are often mounted with `noatime`
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if path not in self._sizes:
+                self._total_bytes += stat.st_size
+                self._sizes[path] = stat.st_size
+            self._sizes.move_to_end(path)
+
+        return content
+
+    def _write_blank(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # modification time of the marker is its fetching time, as for stored tiles
+        self._get_blank_path(path).touch()
+        self.metrics.inc('blank_tiles_stored_total')
+
+    def _write(self, path: Path, content: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self.metrics.timer('write'):
+            # the tile is replaced at once, so readers never get partially written file
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(content)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        self._get_blank_path(path).unlink(missing_ok=True)
+
+        with self._lock:
+            self._total_bytes += len(content) - self._sizes.pop(path, 0)
+            self._sizes[path] = len(content)
+
+            evicted_paths = list()
+            while self.max_bytes is not None and self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+                evicted_path, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+                evicted_paths.append(evicted_path)
+
+        for evicted_path in evicted_paths:
+            evicted_path.unlink(missing_ok=True)
+            self.metrics.inc('evicted_tiles_total')
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of `GET /{map name}/{z}/{x}/{y}` requests with Google tile coordinates, e.g. `/OpenStreetMap/3/4/2`.
+    Optional image suffix after `y` is ignored. Content type of response is detected with tile image signature.
+    """
+    server: 'TileServer'
+
+    max_zoom = 30
+
+    path_pattern = re.compile(r'^/(?P<map>\w+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)(\.\w+)?/?$')
+
+    def do_GET(self) -> None:
+        match = self.path_pattern.match(self.path.split('?')[0])
+        map_ = None if match is None else self.server.maps.get(match['map'])
+
+        if map_ is None:
+            self.send_error(404)
+            return
+
+        zoom, x, y = int(match['z']), int(match['x']), int(match['y'])
+        if zoom > self.max_zoom or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+            self.send_error(404)
+            return
+
+        try:
+            content = self.server.cache.get(map_, map_.Tile.from_google(x, y, zoom))
+        except Exception as e:
+            # exception text can contain internal hosts and connections details, so it's only logged
+            self.log_error('upstream request of %s failed: %r', self.path, e)
+            self.send_error(502, 'Upstream request failed')
+            return
+
+        if content is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        img_format = ImageFormat.get_by(content=content) or self.server.cache.img_format
+        self.send_header('Content-Type', img_format.mimetype)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args) -> None:
+        if self.server.printing:
+            super().log_message(format, *args)
+
+
+class TileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+            self,
+            address: Tuple[str, int],
+            cache: TileCache,
+            maps_: Dict[str, Type[maps.Map]],
+            *,
+            printing=False
+    ) -> None:
+        # language=rst
+        """
+        :param address: host and port for listening
+        :param cache: store of served tiles
+        :param maps_: served maps.Map subclasses by names used in urls
+        :param printing: if `True`, will print requests log
+        """
+        self.cache = cache
+        self.maps = maps_
+        self.printing = printing
+
+        super().__init__(address, TileRequestHandler)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from pyproj import Proj
+
+import maps
+from _tile_downloader import merge_and_crop_in_gtiff, merge_in_gtiff, place_in_gtiff
+from utils import ImageFormat, get_expected_path
+
+ZOOM = 4
+TILE_SIZE = 32
+PALETTES = [
+    {0: (255, 255, 255, 255), 1: (200, 0, 0, 255), 2: (0, 0, 0, 0)},
+    {0: (0, 120, 0, 255), 1: (255, 255, 255, 255)},
+]
+
+
+def write_tiles(tiles_dir, kind, palettes=PALETTES):
+    random = np.random.default_rng(0)
+    for google_y in range(3):
+        for google_x in range(4):
+            path = get_expected_path(maps.OpenStreetMap.Tile.from_google(google_x, google_y, ZOOM), tiles_dir,
+                                     ImageFormat.PNG)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            indexed = kind == 'palette' or (kind == 'mixed' and (google_x + google_y) % 2)
+            count = 1 if indexed else 3
+            meta = dict(driver='PNG', width=TILE_SIZE, height=TILE_SIZE, count=count, dtype='uint8')
+            with rio.open(path, 'w', **meta) as img:
+                if indexed:
+                    palette = palettes[google_x % len(palettes)]
+                    img.write(random.integers(0, len(palette), (1, TILE_SIZE, TILE_SIZE), dtype=np.uint8))
+                    img.write_colormap(1, palette)
+                else:
+                    img.write(random.integers(0, 256, (3, TILE_SIZE, TILE_SIZE), dtype=np.uint8))
+
+
+def get_bbox():
+    # edges are inside of tiles, not on their boundaries
+    (left, bottom), _ = maps.OpenStreetMap.Tile.from_google(0, 2, ZOOM).bounds
+    _, (right, top) = maps.OpenStreetMap.Tile.from_google(3, 0, ZOOM).bounds
+    tile_width = (right - left) / 4
+    return left + 0.37 * tile_width, bottom + 0.81 * tile_width, right - 1.23 * tile_width, top - 0.52 * tile_width
+
+
+@pytest.mark.filterwarnings('ignore::rasterio.errors.NotGeoreferencedWarning')
+@pytest.mark.parametrize('kind', ['rgb', 'palette', 'mixed'])
+def test_placed_tiles_are_equal_to_merged_and_cropped(tmp_path, kind):
+    tiles_dir = tmp_path.joinpath('tiles')
+    write_tiles(tiles_dir, kind)
+    bbox = get_bbox()
+    corner_tiles = maps.OpenStreetMap.get_corner_tiles(bbox, ZOOM)
+
+    merged_path, placed_path = tmp_path.joinpath('merged.tiff'), tmp_path.joinpath('placed.tiff')
+    merge_and_crop_in_gtiff(maps.OpenStreetMap, corner_tiles, bbox, merged_path, tiles_dir, ImageFormat.PNG)
+    place_in_gtiff(maps.OpenStreetMap, corner_tiles, bbox, placed_path, tiles_dir, ImageFormat.PNG)
+
+    with rio.open(merged_path) as merged, rio.open(placed_path) as placed:
+        assert placed.count == merged.count == dict(rgb=3, palette=1, mixed=4)[kind]
+        assert placed.transform.almost_equals(merged.transform)
+        assert placed.nodata == merged.nodata
+        assert np.array_equal(placed.read(), merged.read())
+        if kind == 'palette':
+            assert placed.colormap(1) == merged.colormap(1)
+
+
+@pytest.mark.filterwarnings('ignore::rasterio.errors.NotGeoreferencedWarning')
+def test_warped_area_without_tiles_is_transparent_for_opaque_palettes(tmp_path):
+    tiles_dir = tmp_path.joinpath('tiles')
+    write_tiles(tiles_dir, 'palette', PALETTES[1:])
+    corner_tiles = maps.OpenStreetMap.get_corner_tiles(get_bbox(), ZOOM)
+
+    path = tmp_path.joinpath('warped.tiff')
+    # polar stereographic projection turns tiles area, so its corners are filled with nodata
+    merge_in_gtiff(maps.OpenStreetMap, corner_tiles, path, tiles_dir, ImageFormat.PNG, Proj('EPSG:3413'))
+
+    with rio.open(path) as img:
+        data = img.read(1)
+        assert img.nodata == 2 and img.colormap(1)[2][3] == 0
+        assert data[0, 0] == 2 and data[-1, -1] == 2
+        assert set(np.unique(data)) == {0, 1, 2}
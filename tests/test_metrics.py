@@ -0,0 +1,91 @@
+import json
+import threading
+
+from metrics import Metrics
+
+
+def test_counters_and_histograms_are_grouped_by_labels():
+    metrics = Metrics()
+    metrics.inc('requests_total', mirror='a.org')
+    metrics.inc('requests_total', mirror='a.org')
+    metrics.inc('requests_total', mirror='b.org')
+    metrics.observe('ttfb_ms', 30, mirror='a.org')
+
+    assert metrics.counters['requests_total', (('mirror', 'a.org'),)] == 2
+    assert metrics.counters['requests_total', (('mirror', 'b.org'),)] == 1
+    assert metrics.histograms['ttfb_ms', (('mirror', 'a.org'),)].count == 1
+
+
+def test_hooks_get_every_event():
+    events = list()
+    metrics = Metrics()
+    metrics.add_hook(lambda *event: events.append(event))
+
+    metrics.inc('bytes_total', 10, mirror='a.org')
+    with metrics.timer('decode'):
+        pass
+
+    assert events[0] == ('counter', 'bytes_total', 10, {'mirror': 'a.org'})
+    assert events[1][:2] == ('histogram', 'decode_ms')
+
+
+def test_json_lines():
+    metrics = Metrics()
+    metrics.inc('requests_total', mirror='a.org')
+    metrics.observe('ttfb_ms', 30)
+
+    counter, histogram = map(json.loads, metrics.to_json_lines().splitlines())
+
+    assert counter == dict(type='counter', name='requests_total', labels={'mirror': 'a.org'}, value=1)
+    assert histogram['count'] == 1 and histogram['sum'] == 30 and histogram['buckets']['50'] == 1
+
+
+def test_prometheus_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets=(10, 100, float('inf')))
+    metrics.observe('ttfb_ms', 5)
+    metrics.observe('ttfb_ms', 50)
+
+    lines = metrics.to_prometheus().splitlines()
+
+    assert lines == [
+        '# TYPE tile_downloader_ttfb_ms histogram',
+        'tile_downloader_ttfb_ms_bucket{le="10"} 1',
+        'tile_downloader_ttfb_ms_bucket{le="100"} 2',
+        'tile_downloader_ttfb_ms_bucket{le="+Inf"} 2',
+        'tile_downloader_ttfb_ms_sum 55',
+        'tile_downloader_ttfb_ms_count 2',
+    ]
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.inc('requests_total', mirror='a"b\\c\nd')
+
+    assert 'tile_downloader_requests_total{mirror="a\\"b\\\\c\\nd"} 1' in metrics.to_prometheus()
+
+
+def test_export_is_consistent_during_concurrent_updates():
+    metrics = Metrics()
+    stopped = threading.Event()
+
+    def update():
+        i = 0
+        while not stopped.is_set():
+            metrics.inc('requests_total', mirror=str(i % 100))
+            metrics.observe('ttfb_ms', i % 100, mirror=str(i % 100))
+            i += 1
+
+    threads = [threading.Thread(target=update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(10):
+            for line in metrics.to_json_lines().splitlines():
+                record = json.loads(line)
+                if record['type'] == 'histogram':
+                    assert sum(record['buckets'].values()) == record['count']
+            metrics.to_prometheus()
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+from pixels import TileHeader, PixelLayout, PaletteOverflowWarning, get_pixel_layout, to_pixel_layout, read_tile, \
+    get_tile_header, get_gtiff_options
+
+RED, GREEN, BLUE = (255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255)
+
+
+def get_header(count=1, colormap=None, has_alpha=False):
+    return TileHeader(count, 256, 256, has_alpha, colormap)
+
+
+def test_palettes_are_merged():
+    first, second = {0: RED, 1: GREEN}, {0: GREEN, 1: BLUE, 2: (9, 9, 9, 0)}
+
+    layout = get_pixel_layout([get_header(colormap=first), get_header(colormap=second)])
+
+    assert layout.count == 1
+    assert layout.colormap == {0: RED, 1: GREEN, 2: BLUE, 3: (0, 0, 0, 0)}
+    assert layout.nodata == 3
+
+    data = np.array([[[0, 1, 2]]], dtype=np.uint8)
+    assert to_pixel_layout(data, second, layout).tolist() == [[[1, 2, 3]]]
+
+
+def test_transparent_nodata_is_added_to_opaque_palettes():
+    layout = get_pixel_layout([get_header(colormap={0: RED, 1: GREEN}), get_header(colormap={0: BLUE})])
+
+    assert layout.colormap == {0: RED, 1: GREEN, 2: BLUE, 3: (0, 0, 0, 0)}
+    assert layout.nodata == 3
+
+
+def test_nodata_is_not_added_to_full_palette():
+    layout = get_pixel_layout([get_header(colormap={i: (i, 0, 0, 255) for i in range(256)})])
+
+    assert len(layout.colormap) == 256 and layout.nodata is None
+
+
+def test_palettes_with_too_many_colors_are_merged_without_palette():
+    colormaps = [{0: (i, i // 2, 0, 255)} for i in range(256)] + [{0: (0, 0, 255, 255)}]
+
+    with pytest.warns(PaletteOverflowWarning):
+        layout = get_pixel_layout(get_header(colormap=colormap) for colormap in colormaps)
+
+    assert layout == PixelLayout(3)
+
+
+def test_semi_transparent_palette_is_merged_as_rgba():
+    colormap = {0: RED, 1: (0, 0, 255, 128)}
+
+    layout = get_pixel_layout([get_header(colormap=colormap)])
+
+    assert layout == PixelLayout(4)
+    data = np.array([[[0, 1]]], dtype=np.uint8)
+    assert to_pixel_layout(data, colormap, layout)[:, 0, 1].tolist() == [0, 0, 255, 128]
+
+
+@pytest.mark.parametrize('headers, count', [
+    ([get_header(3), get_header(1)], 3),
+    ([get_header(3), get_header(4, has_alpha=True)], 4),
+    ([get_header(colormap={0: RED}), get_header(3)], 3),
+])
+def test_layout_without_palette(headers, count):
+    assert get_pixel_layout(headers) == PixelLayout(count)
+
+
+def test_gray_and_rgb_data_are_expanded():
+    gray_alpha = np.array([[[7]], [[128]]], dtype=np.uint8)
+    rgb = np.array([[[1]], [[2]], [[3]]], dtype=np.uint8)
+
+    assert to_pixel_layout(gray_alpha, None, PixelLayout(4)).ravel().tolist() == [7, 7, 7, 128]
+    assert to_pixel_layout(rgb, None, PixelLayout(4)).ravel().tolist() == [1, 2, 3, 255]
+    assert to_pixel_layout(rgb, None, PixelLayout(3)).ravel().tolist() == [1, 2, 3]
+
+
+@pytest.mark.filterwarnings('ignore::rasterio.errors.NotGeoreferencedWarning')
+def test_tile_is_read_with_its_header(tmp_path):
+    path = tmp_path.joinpath('tile.png')
+    with rio.open(path, 'w', driver='PNG', width=2, height=2, count=1, dtype='uint8') as img:
+        img.write(np.array([[[0, 1], [1, 0]]], dtype=np.uint8))
+        img.write_colormap(1, {0: RED, 1: GREEN})
+
+    data, header = read_tile(path)
+
+    assert header == get_tile_header(path)
+    assert header.colormap[1] == GREEN and data.shape == (1, 2, 2)
+
+
+def test_gtiff_options():
+    indexed_options = get_gtiff_options(PixelLayout(1, {0: RED}, 0))
+
+    assert indexed_options == dict(count=1, dtype='uint8', nodata=0, photometric='PALETTE')
+    assert get_gtiff_options(PixelLayout(4))['alpha'] == 'YES'
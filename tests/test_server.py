@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import maps
+from metrics import Metrics
+from server import TileCache, TileServer
+from transport import Transport, TransportResponse
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+JPEG = b'\xff\xd8\xff' + b'\x00' * 97
+
+
+class FakeTransport(Transport):
+    def __init__(self, content: bytes = PNG) -> None:
+        self.content = content
+        self.urls = list()
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, url: str) -> TransportResponse:
+        self.urls.append(url)
+        self.release.wait(5)
+        return TransportResponse(url, 200, self.content, 0., 0.)
+
+
+def get_tile(x: int, y: int = 0, zoom: int = 3):
+    return maps.OpenStreetMap.Tile.from_google(x, y, zoom)
+
+
+def wait_for(condition) -> None:
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_stored_tile_is_not_fetched_again(tmp_path):
+    transport = FakeTransport()
+    cache = TileCache(tmp_path, transport)
+
+    assert cache.get(maps.OpenStreetMap, get_tile(1)) == PNG
+    assert cache.get(maps.OpenStreetMap, get_tile(1)) == PNG
+
+    assert len(transport.urls) == 1
+    assert cache.get_path(maps.OpenStreetMap, get_tile(1)).read_bytes() == PNG
+    assert not list(tmp_path.rglob('*.part'))
+
+
+def test_concurrent_requests_of_missing_tile_are_coalesced(tmp_path):
+    transport = FakeTransport()
+    transport.release.clear()
+    metrics = Metrics()
+    cache = TileCache(tmp_path, transport, metrics=metrics)
+
+    results = list()
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(maps.OpenStreetMap, get_tile(1))))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    wait_for(lambda: transport.urls)
+    for thread in threads[1:]:
+        thread.start()
+    wait_for(lambda: metrics.counters['coalesced_requests_total', (('map', 'OpenStreetMap'),)] == 3)
+
+    transport.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [PNG, ] * 4
+    assert len(transport.urls) == 1
+
+
+def test_least_recently_used_tiles_are_evicted(tmp_path):
+    cache = TileCache(tmp_path, FakeTransport(), max_bytes=2 * len(PNG))
+
+    cache.get(maps.OpenStreetMap, get_tile(1))
+    cache.get(maps.OpenStreetMap, get_tile(2))
+    cache.get(maps.OpenStreetMap, get_tile(1))
+    cache.get(maps.OpenStreetMap, get_tile(3))
+
+    assert cache.get_path(maps.OpenStreetMap, get_tile(1)).exists()
+    assert not cache.get_path(maps.OpenStreetMap, get_tile(2)).exists()
+    assert cache.get_path(maps.OpenStreetMap, get_tile(3)).exists()
+
+
+def test_expired_tile_is_fetched_again(tmp_path):
+    transport = FakeTransport()
+    cache = TileCache(tmp_path, transport, ttl=60)
+
+    cache.get(maps.OpenStreetMap, get_tile(1))
+    path = cache.get_path(maps.OpenStreetMap, get_tile(1))
+    os.utime(path, (time.time(), time.time() - 120))
+    cache.get(maps.OpenStreetMap, get_tile(1))
+
+    assert len(transport.urls) == 2
+
+
+@pytest.fixture
+def server_url(tmp_path):
+    cache = TileCache(tmp_path, FakeTransport(JPEG))
+    server = TileServer(('127.0.0.1', 0), cache, {'OpenStreetMap': maps.OpenStreetMap})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f'http://127.0.0.1:{server.server_port}'
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_content_type_is_detected_with_image_signature(server_url):
+    with urllib.request.urlopen(f'{server_url}/OpenStreetMap/3/1/2.png') as response:
+        assert response.headers['Content-Type'] == 'image/jpeg'
+        assert response.read() == JPEG
+
+
+@pytest.mark.parametrize('path', ['/OpenStreetMap/3/8/0', '/OpenStreetMap/1000/0/0', '/Unknown/3/1/2'])
+def test_wrong_tiles_are_not_found(server_url, path):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(server_url + path)
+
+    assert error.value.code == 404
+
+
+class BlankMap(maps.OpenStreetMap):
+    @classmethod
+    def is_ok(cls, tile_bytes):
+        return tile_bytes != PNG
+
+
+def test_blank_tile_is_not_fetched_again_until_expired(tmp_path):
+    transport = FakeTransport()
+    metrics = Metrics()
+    cache = TileCache(tmp_path, transport, ttl=60, metrics=metrics)
+
+    assert cache.get(BlankMap, get_tile(1)) is None
+    assert cache.get(BlankMap, get_tile(1)) is None
+    assert len(transport.urls) == 1
+    assert not cache.get_path(BlankMap, get_tile(1)).exists()
+    assert metrics.counters['blank_hits_total', (('map', 'BlankMap'),)] == 1
+
+    blank_path = cache.get_path(BlankMap, get_tile(1)).with_suffix('.png.blank')
+    os.utime(blank_path, (time.time(), time.time() - 120))
+    cache.get(BlankMap, get_tile(1))
+
+    assert len(transport.urls) == 2
+
+
+class FailingTransport(FakeTransport):
+    def get(self, url: str) -> TransportResponse:
+        raise RuntimeError('pool of internal.host:8080 is full')
+
+
+def test_upstream_error_details_are_not_sent(tmp_path):
+    cache = TileCache(tmp_path, FailingTransport())
+    server = TileServer(('127.0.0.1', 0), cache, {'OpenStreetMap': maps.OpenStreetMap})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/OpenStreetMap/3/1/2')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert error.value.code == 502
+    assert b'internal.host' not in error.value.read()
+    assert 'internal.host' not in error.value.reason
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+import maps
+from _tile_downloader import download_tiles, estimate_download, get_max_zoom_in_budget, fetch_tiles
+from metrics import Metrics
+from transport import Transport, TransportResponse
+from utils import DownloadEstimate, ImageFormat, get_expected_path, load_tiles_stats, update_tiles_stats
+
+CONTENT = b'\x89PNG\r\n\x1a\n' + b'\x00' * 92
+
+
+class FakeTransport(Transport):
+    def __init__(self) -> None:
+        self.urls = list()
+
+    def get(self, url: str) -> TransportResponse:
+        self.urls.append(url)
+        return TransportResponse(url, 200, CONTENT, 0.01, 0.02)
+
+
+class FailingTransport(Transport):
+    def get(self, url: str) -> TransportResponse:
+        return TransportResponse.from_error(url, ConnectionError('refused'), 0.01)
+
+
+def get_bbox(x_range: range, y_range: range, zoom: int):
+    # bbox inside of tiles with given Google coordinates, not touching their edges
+    (left, bottom), _ = maps.OpenStreetMap.Tile.from_google(x_range[0], y_range[-1], zoom).bounds
+    _, (right, top) = maps.OpenStreetMap.Tile.from_google(x_range[-1], y_range[0], zoom).bounds
+    margin = (right - left) / len(x_range) / 4
+    return left + margin, bottom + margin, right - margin, top - margin
+
+
+def get_estimate(zoom, missing_tiles_num, avg_bytes_in_img, avg_seconds_per_img):
+    return DownloadEstimate('OpenStreetMap', zoom, 100, missing_tiles_num, avg_bytes_in_img, avg_seconds_per_img)
+
+
+def test_highest_zoom_in_budget_is_chosen():
+    estimates = [get_estimate(zoom, 4 ** zoom, 1000, 0.1) for zoom in range(1, 6)]
+
+    assert get_max_zoom_in_budget(estimates, max_bytes=100_000) == 3
+    assert get_max_zoom_in_budget(estimates, max_seconds=30) == 4
+    assert get_max_zoom_in_budget(estimates, max_bytes=100_000, max_seconds=2) == 2
+    assert get_max_zoom_in_budget(estimates) == 5
+    assert get_max_zoom_in_budget(estimates, max_bytes=10) is None
+
+
+def test_unknown_averages_fit_only_unlimited_budget():
+    estimate = get_estimate(3, 64, None, None)
+
+    assert estimate.total_bytes is None and estimate.total_seconds is None
+    assert get_max_zoom_in_budget([estimate, ]) == 3
+    assert get_max_zoom_in_budget([estimate, ], max_bytes=10 ** 9) is None
+
+
+def test_zoom_without_missing_tiles_fits_any_budget():
+    estimate = get_estimate(7, 0, None, None)
+
+    assert estimate.total_bytes == 0 and estimate.total_seconds == 0
+    assert get_max_zoom_in_budget([get_estimate(6, 10, 1000, 1), estimate], max_bytes=0, max_seconds=0) == 7
+
+
+def test_stats_are_accumulated(tmp_path):
+    update_tiles_stats(tmp_path, maps.OpenStreetMap, 3, 2, 200, 1.5)
+    update_tiles_stats(tmp_path, maps.OpenStreetMap, 3, 1, 100, 0.5)
+
+    assert load_tiles_stats(tmp_path) == {'OpenStreetMap': {'3': dict(tiles=3, bytes=300, seconds=2.)}}
+
+
+def test_stats_are_accumulated_over_downloads(tmp_path):
+    download_tiles(maps.OpenStreetMap, get_bbox(range(2), range(2), 3), 3, tmp_path, ImageFormat.PNG, FakeTransport())
+    transport = FakeTransport()
+    download_tiles(maps.OpenStreetMap, get_bbox(range(3), range(2), 3), 3, tmp_path, ImageFormat.PNG, transport)
+
+    assert len(transport.urls) == 2
+    zoom_stats = json.loads(tmp_path.joinpath('stats.json').read_text())['OpenStreetMap']['3']
+    assert zoom_stats['tiles'] == 6
+    assert zoom_stats['bytes'] == 6 * len(CONTENT)
+
+
+@pytest.mark.parametrize('sample_size', [1, 3])
+def test_only_missing_tiles_are_sampled(tmp_path, sample_size):
+    bbox, zoom = get_bbox(range(2), range(2), 3), 3
+    existent_tiles = [maps.OpenStreetMap.Tile.from_google(x, 0, zoom) for x in range(2)]
+    for tile in existent_tiles:
+        path = get_expected_path(tile, tmp_path, ImageFormat.PNG)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(CONTENT)
+
+    transport = FakeTransport()
+    estimate, = estimate_download(
+        maps.OpenStreetMap, bbox, [zoom, ], tmp_path, ImageFormat.PNG, transport, sample_size=sample_size
+    )
+
+    sampled_num = min(sample_size, 2)
+    assert len(transport.urls) == sampled_num
+    assert not any(f'/{zoom}/{tile.google[0]}/{tile.google[1]}.png' in url
+                   for url in transport.urls for tile in existent_tiles)
+    assert estimate.tiles_num == 4
+    assert estimate.missing_tiles_num == 2 - sampled_num
+    assert estimate.avg_bytes_in_img == len(CONTENT)
+    assert load_tiles_stats(tmp_path)['OpenStreetMap'][str(zoom)]['tiles'] == sampled_num
+
+
+def test_sampled_tiles_are_not_sampled_again(tmp_path):
+    bbox, zoom = get_bbox(range(4), range(4), 3), 3
+    transport = FakeTransport()
+
+    estimate_download(maps.OpenStreetMap, bbox, [zoom, ], tmp_path, ImageFormat.PNG, transport, sample_size=5)
+    estimate, = estimate_download(
+        maps.OpenStreetMap, bbox, [zoom, ], tmp_path, ImageFormat.PNG, transport, sample_size=5
+    )
+
+    assert len(set(transport.urls)) == 10
+    assert estimate.missing_tiles_num == 6
+    assert load_tiles_stats(tmp_path)['OpenStreetMap'][str(zoom)]['tiles'] == 10
+
+
+def test_network_errors_are_counted_as_failed_requests():
+    metrics = Metrics()
+    tiles = [maps.OpenStreetMap.Tile.from_google(1, 2, 3), ]
+
+    assert list(fetch_tiles(maps.OpenStreetMap, tiles, FailingTransport(), metrics)) == [(tiles[0], None)]
+    labels = (('mirror', 'c.tile.openstreetmap.org'), )
+    assert metrics.counters['failed_requests_total', labels] == 1
+    assert metrics.counters['network_errors_total', labels] == 1
+    assert ('responses_total', labels + (('status', '0'), )) not in metrics.counters
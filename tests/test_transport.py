@@ -0,0 +1,157 @@
+import asyncio
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from transport import AsyncHTTP2Transport, RequestsTransport
+
+pytest.importorskip('httpx')
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    server: 'TileHTTPServer'
+
+    def do_GET(self) -> None:
+        with self.server.lock:
+            self.server.paths.append(self.path)
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+
+        try:
+            if self.path.startswith('/slow/'):
+                self.server.released.wait(5)
+            elif self.path.startswith('/busy/'):
+                time.sleep(0.05)
+
+            status_code = 404 if self.path.startswith('/missing/') else 200
+            content = self.path.encode()
+            self.send_response(status_code)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class TileHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.released = threading.Event()
+        self.paths = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        super().__init__(('127.0.0.1', 0), TileHandler)
+
+
+@pytest.fixture
+def server():
+    server = TileHTTPServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+
+    yield server
+
+    server.released.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    return f'http://127.0.0.1:{port}'
+
+
+@pytest.fixture(params=['requests', 'async'])
+def transport(request):
+    if request.param == 'requests':
+        transport = RequestsTransport()
+    else:
+        transport = AsyncHTTP2Transport(http2=False, concurrency=4, timeout=5)
+
+    with transport:
+        yield transport
+
+
+def test_next_mirror_is_requested_after_error_response(server, transport):
+    urls_gens = [(i, [f'{server.url}/missing/{i}', f'{server.url}/ok/{i}']) for i in range(6)]
+
+    attempts = dict(transport.fetch(urls_gens))
+
+    assert sorted(attempts) == list(range(6))
+    for i, (missing, found) in attempts.items():
+        assert (missing.status_code, missing.ok) == (404, False)
+        assert (found.status_code, found.content) == (200, f'/ok/{i}'.encode())
+
+
+def test_next_mirror_is_requested_after_network_error(server, transport, closed_port_url):
+    urls_gens = [(i, [f'{closed_port_url}/ok/{i}', f'{server.url}/ok/{i}']) for i in range(3)]
+
+    attempts = dict(transport.fetch(urls_gens))
+
+    for i, (failed, found) in attempts.items():
+        assert not failed.ok and failed.status_code == 0 and failed.error
+        assert found.ok and found.content == f'/ok/{i}'.encode()
+
+
+def test_requests_in_flight_are_limited_with_concurrency(server):
+    pulled_keys = list()
+    pulled_keys_on_first_result = None
+
+    def get_urls_gens():
+        for i in range(20):
+            pulled_keys.append(i)
+            yield i, [f'{server.url}/busy/{i}', ]
+
+    with AsyncHTTP2Transport(http2=False, concurrency=4) as transport:
+        results = list()
+        for key, attempts in transport.fetch(get_urls_gens()):
+            if pulled_keys_on_first_result is None:
+                pulled_keys_on_first_result = len(pulled_keys)
+            results.append(key)
+
+    assert sorted(results) == list(range(20))
+    assert 1 < server.max_in_flight <= 4
+    assert pulled_keys_on_first_result <= 4
+
+
+def test_pending_requests_are_cancelled_on_generator_close(server):
+    urls_gens = [(0, [f'{server.url}/ok/0', ])] + [(i, [f'{server.url}/slow/{i}', ]) for i in range(1, 10)]
+
+    async def get_tasks_num():
+        return len(asyncio.all_tasks()) - 1
+
+    with AsyncHTTP2Transport(http2=False, concurrency=4) as transport:
+        fetching = transport.fetch(urls_gens)
+        assert next(fetching)[0] == 0
+        fetching.close()
+
+        deadline = time.time() + 5
+        while transport._run(get_tasks_num()):
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+    assert len(server.paths) <= 5
+
+
+def test_close_is_idempotent():
+    transport = AsyncHTTP2Transport()
+    transport.close()
+    transport.close()
+
+    transport = RequestsTransport()
+    transport.close()
+    transport.close()
@@ -0,0 +1,59 @@
+import pytest
+
+from utils import TileOrder, get_existent_tiles_tms, ImageFormat
+
+RANGES = [
+    (range(1), range(1)),
+    (range(8), range(8)),
+    (range(3, 11), range(5, 7)),
+    (range(1000, 1013), range(2000, 2029)),
+]
+
+
+@pytest.mark.parametrize('order', TileOrder)
+@pytest.mark.parametrize('x_range, y_range', RANGES)
+def test_order_covers_every_tile_once(order, x_range, y_range):
+    xy_s = list(order.get_xy_gen(x_range, y_range))
+
+    assert len(xy_s) == len(x_range) * len(y_range)
+    assert set(xy_s) == {(x, y) for x in x_range for y in y_range}
+
+
+def test_tms_and_row_orders():
+    assert list(TileOrder.TMS.get_xy_gen(range(2), range(2))) == [(0, 1), (0, 0), (1, 1), (1, 0)]
+    assert list(TileOrder.ROW.get_xy_gen(range(2), range(2))) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+
+
+def test_quadkey_order_keeps_parent_tiles_together():
+    xy_s = list(TileOrder.QUADKEY.get_xy_gen(range(4), range(4)))
+
+    assert xy_s[:4] == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    for i in range(0, 16, 4):
+        assert len({(x // 2, y // 2) for x, y in xy_s[i:i + 4]}) == 1
+
+
+@pytest.mark.parametrize('size', [2, 4, 16, 64])
+def test_hilbert_order_moves_to_neighbour_tiles(size):
+    xy_s = list(TileOrder.HILBERT.get_xy_gen(range(size), range(size)))
+
+    assert all(abs(x - next_x) + abs(y - next_y) == 1 for (x, y), (next_x, next_y) in zip(xy_s, xy_s[1:]))
+
+
+def test_existent_tiles_are_found_within_ranges(tmp_path):
+    zoom_dir = tmp_path.joinpath('zoomlevel_3')
+    zoom_dir.mkdir()
+    for name in ['tms_1_2.png', 'tms_2_3.png', 'tms_5_5.png', 'tms_1_1.jpg', 'tms_x_1.png', 'stats.json']:
+        zoom_dir.joinpath(name).touch()
+
+    assert get_existent_tiles_tms(tmp_path, 3, range(3), range(4), ImageFormat.PNG) == {(1, 2), (2, 3)}
+    assert get_existent_tiles_tms(tmp_path, 4, range(3), range(4), ImageFormat.PNG) == set()
+
+
+@pytest.mark.parametrize('content, img_format', [
+    (b'\xff\xd8\xff\xe0', ImageFormat.JPEG),
+    (b'\x89PNG\r\n\x1a\n\x00', ImageFormat.PNG),
+    (b'GIF89a\x00', ImageFormat.GIF),
+    (b'<html>', None),
+])
+def test_image_format_is_detected_with_content(content, img_format):
+    assert ImageFormat.get_by(content=content) is img_format
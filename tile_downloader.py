@@ -1,15 +1,19 @@
+from contextlib import nullcontext
 from inspect import isclass
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Union, Type, Optional
+from typing import Union, Type, Optional, Iterable, List, Tuple, Sequence
 
-import requests
 from pyproj import transform, Proj
 
 import maps
+from metrics import Metrics
+from server import TileCache, TileServer
+from transport import Transport, RequestsTransport
 from _tile_downloader import download_in_gtiff as _download_in_gtiff, download_tiles as _download_tiles, \
-    construct_gtiff as _construct_gtiff
-from utils import ImageFormat
+    construct_gtiff as _construct_gtiff, estimate_download as _estimate_download, \
+    get_max_zoom_in_budget as _get_max_zoom_in_budget
+from utils import ImageFormat, DownloadEstimate, TileOrder
 
 
 def _get_projection(**kwargs):
@@ -61,6 +65,16 @@ def _get_area_args_as_bbox(**kwargs):
     return bbox
 
 
+def _get_transport(transport: Optional[Transport], proxies: Optional[dict]):
+    if transport is None:
+        return RequestsTransport(proxies=proxies)
+
+    if proxies is not None:
+        raise TypeError
+
+    return nullcontext(transport)
+
+
 def _get_zoom(**kwargs):
     zoom = kwargs.get('zoom')
 
@@ -82,8 +96,11 @@ def download_tiles(
         img_format: Union[ImageFormat, str] = ImageFormat.PNG,
         *,
         proxies: Optional[dict] = None,
+        transport: Optional[Transport] = None,
+        order: Union[TileOrder, str] = TileOrder.HILBERT,
         overwriting: bool = False,
         printing=False,
+        metrics: Optional[Metrics] = None,
         **kwargs
 ) -> None:
     # language=rst
@@ -93,9 +110,13 @@ def download_tiles(
     :param tiles_dir: path to directory for downloading
     :param img_format: tiles images format
     :param proxies: dict with protocol standart names as keys and proxies addresses as values
+    :param transport: optional `transport.Transport` for HTTP requests, e.g. `transport.AsyncHTTP2Transport`.
+    It isn't closed after the call, so it can be reused. If `None`, `transport.RequestsTransport` with `proxies` is used
+    :param order: `utils.TileOrder` of tiles downloading or its value, e.g. `'hilbert'` or `'row'`
     :param overwriting: if `True`, will overwrite files with expected tiles names.
     if `False`, will skip existent files with expected tiles names.
     :param printing: if `True`, will print info about downloading. Default -- `False`
+    :param metrics: optional `metrics.Metrics` collector of per-stage counters and timings
     :param kwargs:
     ###
     Optional projection keyword
@@ -135,21 +156,109 @@ def download_tiles(
     if not isinstance(img_format, ImageFormat):
         img_format = ImageFormat.get_by(suffix=img_format, asserting=True)
 
-    session = requests.session()
-    if proxies is not None:
-        session.proxies = proxies
+    with _get_transport(transport, proxies) as transport:
+        _download_tiles(
+            map_,
+            bbox_in_map_projection,
+            _get_zoom(**kwargs),
+            Path(tiles_dir),
+            img_format,
+            transport,
+            order=TileOrder(order),
+            overwriting=overwriting,
+            printing=printing,
+            metrics=metrics
+        )
 
-    _download_tiles(
-        map_,
-        bbox_in_map_projection,
-        _get_zoom(**kwargs),
-        Path(tiles_dir),
-        img_format,
-        session,
-        overwriting=overwriting,
-        printing=printing
+
+def estimate_download(
+        map_: Union[Type[maps.Map], str],
+        zooms: Iterable[int],
+        tiles_dir: Union[Path, str, None] = None,
+        img_format: Union[ImageFormat, str] = ImageFormat.PNG,
+        *,
+        proxies: Optional[dict] = None,
+        transport: Optional[Transport] = None,
+        sample_size: int = 5,
+        max_bytes: Optional[float] = None,
+        max_seconds: Optional[float] = None,
+        printing=False,
+        metrics: Optional[Metrics] = None,
+        **kwargs
+) -> Tuple[List[DownloadEstimate], Optional[int]]:
+    # language=rst
+    """
+    Estimate size and duration of downloading `map_` tiles from given area for every zoom-level from `zooms`
+    before the downloading itself, and choose the highest zoom-level fitting in bytes and time budget.
+    Estimates are based on `sample_size` random missing tiles fetched for every zoom-level, and on stats
+    and existent tiles of `tiles_dir`, which are collected by previous `download_tiles` and estimating calls.
+    Zoom-levels without missing tiles fit in any budget.
+    :param map_: maps.Map subclass, which tiles will be downloaded, or name of that subclass from maps.py
+    :param zooms: zoom-levels for estimating
+    :param tiles_dir: optional path to directory for downloading. Sampled tiles and their stats will be saved there
+    :param img_format: tiles images format
+    :param proxies: dict with protocol standart names as keys and proxies addresses as values
+    :param transport: optional `transport.Transport` for HTTP requests, e.g. `transport.AsyncHTTP2Transport`.
+    It isn't closed after the call, so it can be reused. If `None`, `transport.RequestsTransport` with `proxies` is used
+    :param sample_size: quantity of tiles fetched for every zoom-level. If `0`, only `tiles_dir` stats are used
+    :param max_bytes: budget of downloaded bytes. If `None`, bytes are unlimited
+    :param max_seconds: budget of downloading time in seconds. If `None`, time is unlimited
+    :param printing: if `True`, will print estimates
+    :param metrics: optional `metrics.Metrics` collector of per-stage counters and timings
+    :param kwargs:
+    ###
+    Optional projection keyword
+    ###
+    As one of the next keywords:
+    * `projection` -- py:class:`pyproj.Proj` projection object
+    * `crs` of `srs` -- coordinate reference system as PROJ.4 string
+    If projection wasn't defined, then will used WGS 84 latitude longitude reference system
+
+    ###
+    Area keywords
+    ###
+    Area bounds should given for given projection in one of the following form:
+    * `bbox` of area coordinates in from `(min_x, min_y, max_x, max_y)`
+    * `min_x`, `min_y`, `max_x`, `max_y`
+    * `left`, `bottom`, `right`, `top`
+    * `min_lon`, `min_lat`, `max_lon`, `max_lat` for latitudes and
+    longitudes even for non-geographic coordinate systems.
+
+    :return: estimates sorted by zoom-level, and the highest zoom-level fitting in budget
+    or `None` if there is no such zoom-level
+    """
+    map_ = map_ if isclass(map_) and issubclass(map_, maps.Map) else getattr(maps, map_)
+    projection = _get_projection(**kwargs)
+
+    bbox_in_source_projection = _get_area_args_as_bbox(**kwargs)
+    bbox_in_map_projection = (
+        transform(projection, map_.projection, *bbox_in_source_projection[:2]) +
+        transform(projection, map_.projection, *bbox_in_source_projection[2:])
     )
 
+    if not isinstance(img_format, ImageFormat):
+        img_format = ImageFormat.get_by(suffix=img_format, asserting=True)
+
+    with _get_transport(transport, proxies) as transport:
+        estimates = _estimate_download(
+            map_,
+            bbox_in_map_projection,
+            zooms,
+            None if tiles_dir is None else Path(tiles_dir),
+            img_format,
+            transport,
+            sample_size=sample_size,
+            metrics=metrics
+        )
+    zoom = _get_max_zoom_in_budget(estimates, max_bytes, max_seconds)
+
+    if printing:
+        for estimate in estimates:
+            print(estimate)
+        print(f'Highest zoom-level in budget: {zoom}')
+
+    return estimates, zoom
+
 
 def construct_gtiff(
         map_: Union[Type[maps.Map], str],
@@ -157,6 +266,7 @@ def construct_gtiff(
         tiles_dir: Union[Path, str],
         img_format: Union[ImageFormat, str] = ImageFormat.PNG,
         printing=False,
+        metrics: Optional[Metrics] = None,
         **kwargs
 ) -> None:
     # language=rst
@@ -167,6 +277,7 @@ def construct_gtiff(
     :param tiles_dir: path to directory that contains necessary tiles
     :param img_format: tiles images format
     :param printing: if `True`, will print info
+    :param metrics: optional `metrics.Metrics` collector of per-stage counters and timings
     :param kwargs:
     ###
     Optional projection keyword
@@ -204,7 +315,8 @@ def construct_gtiff(
         Path(tiles_dir),
         img_format,
         _get_projection(**kwargs),
-        printing=printing
+        printing=printing,
+        metrics=metrics
     )
 
 
@@ -215,8 +327,12 @@ def download_in_gtiff(
         img_format: ImageFormat = ImageFormat.PNG,
         *,
         proxies: Optional[dict] = None,
+        transport: Optional[Transport] = None,
+        order: Union[TileOrder, str] = TileOrder.HILBERT,
+        preview_zooms: Iterable[int] = (),
         overwriting: bool = False,
         printing=False,
+        metrics: Optional[Metrics] = None,
         **kwargs
 ) -> None:
     # language=rst
@@ -228,9 +344,16 @@ def download_in_gtiff(
     in temporary directory, and will be deleted after creation of a GeoTIFF file.
     :param img_format: tiles images format
     :param proxies: dict with protocol standart names as keys and proxies addresses as values
+    :param transport: optional `transport.Transport` for HTTP requests, e.g. `transport.AsyncHTTP2Transport`.
+    It isn't closed after the call, so it can be reused. If `None`, `transport.RequestsTransport` with `proxies` is used
+    :param order: `utils.TileOrder` of tiles downloading or its value, e.g. `'hilbert'` or `'row'`
+    :param preview_zooms: zoom-levels lower than the zoom-level, which are downloaded first, from the coarsest one.
+    For every of them low-resolution GeoTIFF is constructed at `path` with `_zoom_{zoom}` suffix of the name,
+    so previews are available before the end of long downloading
     :param overwriting: if `True`, during downloading tiles, it will overwrite files with expected tiles names.
     if `False`, will skip existent files with expected tiles names.
     :param printing: if `True`, will print info
+    :param metrics: optional `metrics.Metrics` collector of per-stage counters and timings
     :param kwargs:
     ###
     Optional projection keyword
@@ -260,24 +383,85 @@ def download_in_gtiff(
     if not isinstance(img_format, ImageFormat):
         img_format = ImageFormat.get_by(suffix=img_format, asserting=True)
 
-    session = requests.session()
-    if proxies is not None:
-        session.proxies = proxies
-
     temp_dir = TemporaryDirectory() if tiles_dir is None else None
 
-    _download_in_gtiff(
-        map_ if isclass(map_) and issubclass(map_, maps.Map) else getattr(maps, map_),
-        _get_area_args_as_bbox(**kwargs),
-        _get_zoom(**kwargs),
-        Path(path),
-        Path(temp_dir.name if tiles_dir is None else tiles_dir),
-        img_format,
-        session,
-        projection=_get_projection(**kwargs),
-        overwriting=overwriting,
-        printing=printing
-    )
+    with _get_transport(transport, proxies) as transport:
+        _download_in_gtiff(
+            map_ if isclass(map_) and issubclass(map_, maps.Map) else getattr(maps, map_),
+            _get_area_args_as_bbox(**kwargs),
+            _get_zoom(**kwargs),
+            Path(path),
+            Path(temp_dir.name if tiles_dir is None else tiles_dir),
+            img_format,
+            transport,
+            projection=_get_projection(**kwargs),
+            order=TileOrder(order),
+            preview_zooms=preview_zooms,
+            overwriting=overwriting,
+            printing=printing,
+            metrics=metrics
+        )
 
     if temp_dir is not None:
         temp_dir.cleanup()
+
+
+def serve_tiles(
+        tiles_dir: Union[Path, str],
+        maps_: Optional[Sequence[Union[Type[maps.Map], str]]] = None,
+        img_format: Union[ImageFormat, str] = ImageFormat.PNG,
+        *,
+        host: str = '127.0.0.1',
+        port: int = 8000,
+        proxies: Optional[dict] = None,
+        transport: Optional[Transport] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        printing=False,
+        metrics: Optional[Metrics] = None
+) -> None:
+    # language=rst
+    """
+    Serve tiles as `GET /{map name}/{z}/{x}/{y}` with Google tile coordinates from local tiles store,
+    fetching missing tiles from upstream map services, until the process is interrupted.
+    Concurrent requests of the same missing tile share one upstream fetch,
+    so every tile is fetched from upstream once for all store clients.
+    :param tiles_dir: path to directory of the store. Tiles of every map are kept in `tiles_dir/{map name}`
+    :param maps_: served maps.Map subclasses or names of that subclasses from maps.py.
+    If `None`, all maps from maps.py are served
+    :param img_format: tiles images format
+    :param host: host for listening
+    :param port: port for listening
+    :param proxies: dict with protocol standart names as keys and proxies addresses as values
+    :param transport: optional `transport.Transport` for upstream HTTP requests. It isn't closed after serving.
+    If `None`, `transport.RequestsTransport` with `proxies` is used
+    :param max_bytes: maximum size of the store, after which least recently used tiles are deleted.
+    If `None`, size is unlimited
+    :param ttl: quantity of seconds, after which stored tile is fetched from upstream again.
+    If `None`, tiles don't expire
+    :param printing: if `True`, will print requests log
+    :param metrics: optional `metrics.Metrics` collector of caching and downloading counters and timings
+    :return:
+    """
+    if maps_ is None:
+        maps_ = [
+            value for value in vars(maps).values()
+            if isclass(value) and issubclass(value, maps.Map) and value is not maps.Map
+        ]
+    maps_ = [map_ if isclass(map_) and issubclass(map_, maps.Map) else getattr(maps, map_) for map_ in maps_]
+
+    if not isinstance(img_format, ImageFormat):
+        img_format = ImageFormat.get_by(suffix=img_format, asserting=True)
+
+    with _get_transport(transport, proxies) as transport:
+        cache = TileCache(tiles_dir, transport, img_format, max_bytes=max_bytes, ttl=ttl, metrics=metrics)
+
+        with TileServer((host, port), cache, {map_.__name__: map_ for map_ in maps_}, printing=printing) as server:
+            if printing:
+                url = f'http://{host}:{port}/{{map}}/{{z}}/{{x}}/{{y}}'
+                print(f'Serving {len(maps_)} maps from {tiles_dir} on {url} ...')
+
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,259 @@
+import asyncio
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Hashable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+UrlsGens = Iterable[Tuple[Hashable, Iterable[str]]]
+Attempts = Tuple[Hashable, List['TransportResponse']]
+
+
+class TransportResponse(NamedTuple):
+    # language=rst
+    """
+    Response for `url` or network error, occurred during its requesting. For the error `status_code` is `0`,
+    `content` is empty and `error` is description of the error
+    """
+    url: str
+    status_code: int
+    content: bytes
+    headers_seconds: float
+    seconds: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code < 400
+
+    @classmethod
+    def from_error(cls, url: str, error: Exception, seconds: float) -> 'TransportResponse':
+        return cls(url, 0, b'', seconds, seconds, f'{type(error).__name__}: {error}')
+
+
+class Transport(ABC):
+    """
+    Base class for HTTP transports, used for tiles downloading.
+    Transport can be reused for several downloading calls and should be closed with `close` or with `with` statement.
+    To create your own Transport subclass, you should overwrite method `get`
+    and optionally `fetch` for concurrent downloading.
+    """
+
+    @abstractmethod
+    def get(self, url: str) -> TransportResponse:
+        # language=rst
+        """
+        Returns response for `url`. Network errors, e.g. connection errors and timeouts, should be returned
+        as failed responses with `TransportResponse.from_error`, so the next mirror can be requested
+        """
+        raise NotImplementedError
+
+    def fetch(self, urls_gens: UrlsGens, delay: float = 0) -> Iterator[Attempts]:
+        # language=rst
+        """
+        Request every key urls one by one until the first successful response.
+        :param urls_gens: pairs of key, e.g. tile, and its mirrors urls
+        :param delay: quantity of seconds between successful requests
+        :return: generator of keys with all their responses in requesting order. Keys could be yielded in any order
+        """
+        for key, urls in urls_gens:
+            attempts = list()
+            for url in urls:
+                attempts.append(self.get(url))
+                if attempts[-1].ok:
+                    time.sleep(delay)
+                    break
+
+            yield key, attempts
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RequestsTransport(Transport):
+    """
+    Sequential HTTP/1.1 transport on `requests.Session` with keep-alive connections pool for every host.
+    """
+
+    def __init__(
+            self,
+            session: Optional[requests.Session] = None,
+            *,
+            proxies: Optional[dict] = None,
+            pool_connections: int = 10,
+            pool_maxsize: int = 10,
+            max_retries: int = 0,
+            keep_alive: bool = True
+    ) -> None:
+        # language=rst
+        """
+        :param session: optional session for requests. If `None`, new session will be created
+        :param proxies: dict with protocol standart names as keys and proxies addresses as values
+        :param pool_connections: quantity of hosts, which connections pools are cached
+        :param pool_maxsize: maximum quantity of connections saved in the pool of every host
+        :param max_retries: maximum quantity of retries for failed connections
+        :param keep_alive: if `False`, connections will be closed after every request
+        """
+        self.session = requests.session() if session is None else session
+
+        if proxies is not None:
+            self.session.proxies = proxies
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url: str) -> TransportResponse:
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, stream=True)
+            headers_received = time.perf_counter()
+            content = response.content
+        except requests.RequestException as e:
+            return TransportResponse.from_error(url, e, time.perf_counter() - start)
+
+        return TransportResponse(
+            url, response.status_code, content, headers_received - start, time.perf_counter() - start
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncHTTP2Transport(Transport):
+    """
+    Concurrent transport on `httpx.AsyncClient`, which multiplexes requests over few HTTP/2 connections
+    for every mirror host. Requires `httpx` with `h2` package: `pip install httpx[http2]`.
+
+    Event loop of the transport works in its own thread, so the transport can be used both from synchronous code
+    and from the code with running event loop.
+    As connections are long-living, host names are resolved only on opening of new connections.
+    """
+
+    def __init__(
+            self,
+            *,
+            proxies: Optional[str] = None,
+            concurrency: int = 64,
+            max_connections: int = 16,
+            max_keepalive_connections: int = 16,
+            keepalive_expiry: float = 60.,
+            http2: bool = True,
+            timeout: float = 30.
+    ) -> None:
+        # language=rst
+        """
+        :param proxies: optional proxy url for all requests
+        :param concurrency: maximum quantity of simultaneous requests
+        :param max_connections: maximum quantity of opened connections for all hosts
+        :param max_keepalive_connections: maximum quantity of idle connections kept for reusing
+        :param keepalive_expiry: quantity of seconds, during which idle connection is kept for reusing
+        :param http2: if `False`, only HTTP/1.1 will be used
+        :param timeout: quantity of seconds for waiting of network operations
+        """
+        import httpx
+
+        self.concurrency = concurrency
+        self._transport_error = httpx.TransportError
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        async def create_client():
+            return httpx.AsyncClient(
+                http2=http2,
+                proxy=proxies,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections,
+                    keepalive_expiry=keepalive_expiry
+                )
+            )
+
+        self._client = self._run(create_client())
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _get(self, url: str) -> TransportResponse:
+        start = time.perf_counter()
+        try:
+            async with self._client.stream('GET', url) as response:
+                headers_received = time.perf_counter()
+                content = await response.aread()
+        except self._transport_error as e:
+            return TransportResponse.from_error(url, e, time.perf_counter() - start)
+
+        return TransportResponse(
+            url, response.status_code, content, headers_received - start, time.perf_counter() - start
+        )
+
+    async def _fetch_urls(self, key: Hashable, urls: Iterable[str]) -> Attempts:
+        attempts = list()
+        for url in urls:
+            attempts.append(await self._get(url))
+            if attempts[-1].ok:
+                break
+
+        return key, attempts
+
+    def get(self, url: str) -> TransportResponse:
+        return self._run(self._get(url))
+
+    def fetch(self, urls_gens: UrlsGens, delay: float = 0) -> Iterator[Attempts]:
+        # language=rst
+        """
+        Keys and urls are pulled from `urls_gens` in the calling thread, no more than `concurrency` keys ahead
+        of yielded results, so the event loop is busy only with network I/O.
+        """
+        results = queue.Queue()
+        futures = set()
+        urls_gens = iter(urls_gens)
+        exhausted = False
+
+        try:
+            while not exhausted or futures:
+                while not exhausted and len(futures) < self.concurrency:
+                    try:
+                        key, urls = next(urls_gens)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    future = asyncio.run_coroutine_threadsafe(self._fetch_urls(key, list(urls)), self._loop)
+                    future.add_done_callback(results.put)
+                    futures.add(future)
+
+                    if delay:
+                        time.sleep(delay)
+
+                if futures:
+                    future = results.get()
+                    futures.discard(future)
+                    yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -1,13 +1,21 @@
+import json
 import mimetypes
+import os
 from enum import Enum
 from pathlib import Path
-from typing import Union, Optional, Type
+from typing import Union, Optional, Type, NamedTuple, Iterator, Tuple, Set
 
 from darkgeotile import BaseTile
 import humanize
 import tqdm
 import math
 
+IMAGE_SIGNATURES = {
+    'image/jpeg': (b'\xff\xd8\xff', ),
+    'image/png': (b'\x89PNG\r\n\x1a\n', ),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+}
+
 
 class ImageFormat(Enum):
     JPEG = JPG = ('image/jpeg', '.jpg')
@@ -27,15 +35,129 @@ class ImageFormat(Enum):
         self.suffix = suffix
 
     @classmethod
-    def get_by(cls, *, suffix, asserting=False):
+    def get_by(cls, *, suffix=None, content=None, asserting=False):
+        # language=rst
+        """
+        :param suffix: image file suffix, e.g. `'.png'`
+        :param content: image as `bytes`, which format is detected with its signature
+        :param asserting: if `True`, will raise exception for unknown format instead of returning `None`
+        :return: image format
+        """
         for img_format in cls:
             if suffix in img_format.possible_suffixes:
                 return img_format
+            if content is not None and content.startswith(IMAGE_SIGNATURES[img_format.mimetype]):
+                return img_format
 
         if asserting:
             raise Exception('unknown image format')
 
 
+class TileOrder(Enum):
+    # language=rst
+    """
+    Orders of tiles downloading, given with Google tile coordinates (`y` grows to the south):
+    * `TMS` -- column by column with TMS `y`, as `maps.Map.get_tile_gen` did originally
+    * `ROW` -- row by row, as tiles are merged in a GeoTIFF
+    * `QUADKEY` -- quadkey (Z-order) curve, keeping tiles of the same parent tile together
+    * `HILBERT` -- Hilbert curve, where every next tile is a neighbour of the previous one
+    """
+    TMS = 'tms'
+    ROW = 'row'
+    QUADKEY = 'quadkey'
+    HILBERT = 'hilbert'
+
+    def get_xy_gen(self, x_range: range, y_range: range) -> Iterator[Tuple[int, int]]:
+        # language=rst
+        """
+        :param x_range: range of Google `x` tile coordinates
+        :param y_range: range of Google `y` tile coordinates
+        :return: generator of Google `(x, y)` tile coordinates in this order
+        """
+        if self is TileOrder.TMS:
+            return ((x, y) for x in x_range for y in reversed(y_range))
+        if self is TileOrder.ROW:
+            return ((x, y) for y in y_range for x in x_range)
+
+        size = 2 ** math.ceil(math.log2(max(x_range.stop, y_range.stop, 1)))
+        if self is TileOrder.QUADKEY:
+            return _get_quadkey_xy_gen(0, 0, size, x_range, y_range)
+        return _get_hilbert_xy_gen(0, 0, size, 0, 0, size, x_range, y_range)
+
+
+def _is_intersecting(min_x: int, min_y: int, max_x: int, max_y: int, x_range: range, y_range: range) -> bool:
+    return min_x < x_range.stop and max_x > x_range.start and min_y < y_range.stop and max_y > y_range.start
+
+
+def _get_quadkey_xy_gen(x: int, y: int, size: int, x_range: range, y_range: range) -> Iterator[Tuple[int, int]]:
+    if not _is_intersecting(x, y, x + size, y + size, x_range, y_range):
+        return
+
+    if size == 1:
+        yield x, y
+        return
+
+    half = size // 2
+    for dy in (0, half):
+        for dx in (0, half):
+            yield from _get_quadkey_xy_gen(x + dx, y + dy, half, x_range, y_range)
+
+
+def _get_hilbert_xy_gen(
+        x: int, y: int, xi: int, xj: int, yi: int, yj: int, x_range: range, y_range: range
+) -> Iterator[Tuple[int, int]]:
+    # square with `(x, y)` corner spanned by `(xi, xj)` and `(yi, yj)` vectors
+    min_x, max_x = sorted((x, x + xi + yi))
+    min_y, max_y = sorted((y, y + xj + yj))
+    if not _is_intersecting(min_x, min_y, max_x, max_y, x_range, y_range):
+        return
+
+    if max_x - min_x == 1:
+        yield min_x, min_y
+        return
+
+    xi, xj, yi, yj = xi // 2, xj // 2, yi // 2, yj // 2
+    yield from _get_hilbert_xy_gen(x, y, yi, yj, xi, xj, x_range, y_range)
+    yield from _get_hilbert_xy_gen(x + xi, y + xj, xi, xj, yi, yj, x_range, y_range)
+    yield from _get_hilbert_xy_gen(x + xi + yi, y + xj + yj, xi, xj, yi, yj, x_range, y_range)
+    yield from _get_hilbert_xy_gen(x + xi + 2 * yi, y + xj + 2 * yj, -yi, -yj, -xi, -xj, x_range, y_range)
+
+
+TILES_STATS_FILE_NAME = 'stats.json'
+
+
+class DownloadEstimate(NamedTuple):
+    # language=rst
+    """
+    Estimated cost of downloading area tiles with certain zoom-level.
+    Averages are `None`, if there were neither sampled tiles nor historical stats.
+    If there are no missing tiles, totals are zero even with unknown averages.
+    """
+    map_name: str
+    zoom: int
+    tiles_num: int
+    missing_tiles_num: int
+    avg_bytes_in_img: Optional[float]
+    avg_seconds_per_img: Optional[float]
+
+    @property
+    def total_bytes(self) -> Optional[float]:
+        if not self.missing_tiles_num:
+            return 0
+        return None if self.avg_bytes_in_img is None else self.missing_tiles_num * self.avg_bytes_in_img
+
+    @property
+    def total_seconds(self) -> Optional[float]:
+        if not self.missing_tiles_num:
+            return 0.
+        return None if self.avg_seconds_per_img is None else self.missing_tiles_num * self.avg_seconds_per_img
+
+    def __str__(self) -> str:
+        size = 'unknown size' if self.total_bytes is None else humanize.naturalsize(self.total_bytes)
+        duration = 'unknown time' if self.total_seconds is None else humanize.naturaldelta(self.total_seconds)
+        return f'{self.map_name} zoom {self.zoom}: {self.missing_tiles_num}/{self.tiles_num} tiles, {size}, {duration}'
+
+
 class TileDownloadingProgressbar(tqdm.tqdm):
     def __init__(self, *args, **kwargs):
         self.avg_bytes_in_img = 0
@@ -66,5 +188,89 @@ def get_expected_path(tile: Type[BaseTile], img_dir: Union[str, Path], img_forma
     :param img_dir:
     :return: expected path for tile
     """
-    dir_ = Path(img_dir).joinpath(f'zoomlevel_{tile.zoom}')
-    return dir_.joinpath(f'tms_{tile.tms_x}_{tile.tms_y}').with_suffix(img_format.suffix)
+    return get_zoom_dir(img_dir, tile.zoom).joinpath(f'tms_{tile.tms_x}_{tile.tms_y}').with_suffix(img_format.suffix)
+
+
+def get_zoom_dir(img_dir: Union[str, Path], zoom: int) -> Path:
+    # language=rst
+    """
+    :param img_dir:
+    :param zoom:
+    :return: expected directory for tiles with `zoom` zoom-level
+    """
+    return Path(img_dir).joinpath(f'zoomlevel_{zoom}')
+
+
+def get_existent_tiles_tms(
+        img_dir: Union[str, Path],
+        zoom: int,
+        tms_x_range: range,
+        tms_y_range: range,
+        img_format: ImageFormat
+) -> Set[Tuple[int, int]]:
+    # language=rst
+    """
+    Find existent tiles within TMS ranges with the only listing of zoom-level directory,
+    without checking of every tile path
+    :param img_dir:
+    :param zoom:
+    :param tms_x_range: range of TMS x coordinates of found tiles
+    :param tms_y_range: range of TMS y coordinates of found tiles
+    :param img_format:
+    :return: TMS coordinates of existent tiles
+    """
+    zoom_dir = get_zoom_dir(img_dir, zoom)
+    if not zoom_dir.exists():
+        return set()
+
+    existent_tiles_tms = set()
+    for name in os.listdir(zoom_dir):
+        stem, suffix = os.path.splitext(name)
+        if suffix != img_format.suffix or not stem.startswith('tms_'):
+            continue
+
+        try:
+            tms_x, tms_y = map(int, stem[len('tms_'):].split('_'))
+        except ValueError:
+            continue
+
+        if tms_x in tms_x_range and tms_y in tms_y_range:
+            existent_tiles_tms.add((tms_x, tms_y))
+
+    return existent_tiles_tms
+
+
+def load_tiles_stats(img_dir: Union[str, Path]) -> dict:
+    # language=rst
+    """
+    :param img_dir:
+    :return: historical downloading stats of `img_dir` as
+    `{map_name: {str(zoom): {'tiles': ..., 'bytes': ..., 'seconds': ...}}}`
+    """
+    path = Path(img_dir).joinpath(TILES_STATS_FILE_NAME)
+    return json.loads(path.read_text()) if path.exists() else dict()
+
+
+def update_tiles_stats(
+        img_dir: Union[str, Path],
+        map_: type,
+        zoom: int,
+        tiles_num: int,
+        bytes_num: int,
+        seconds: float
+) -> None:
+    # language=rst
+    """
+    Add quantity of downloaded tiles, bytes and spent seconds for `map_` with `zoom` zoom-level
+    to historical downloading stats of `img_dir`
+    """
+    Path(img_dir).mkdir(parents=True, exist_ok=True)
+
+    stats = load_tiles_stats(img_dir)
+    zoom_stats = stats.setdefault(map_.__name__, dict()).setdefault(str(zoom), dict(tiles=0, bytes=0, seconds=0.))
+
+    zoom_stats['tiles'] += tiles_num
+    zoom_stats['bytes'] += bytes_num
+    zoom_stats['seconds'] += seconds
+
+    Path(img_dir).joinpath(TILES_STATS_FILE_NAME).write_text(json.dumps(stats, indent=2))